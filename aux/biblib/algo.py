@@ -26,6 +26,11 @@ _CONTROL_SEQS = {
     '\\o': 'ø', '\\O': 'Ø', '\\l': 'ł', '\\L': 'Ł', '\\ss': 'ß'
 }
 
+# Name list separators for NameParser
+_AND_RE = re.compile('[ \t]and(?=[ \t])', re.IGNORECASE)
+_COMMA_RE = re.compile(',')
+_TOKEN_SEP_RE = re.compile('([-~ \t])[-~ \t]*')
+
 class NameParser:
     def __init__(self):
         pass
@@ -41,13 +46,20 @@ class NameParser:
                 depth -= 1
         return depths
 
-    def __split_depth0(self, regexp, data, flags=0):
-        regexp = re.compile(regexp, flags=flags)
-        depths = self.__depth(data)
-        parts, last = [], 0
+    def __split_depth0(self, regexp, data):
+        """Split data at the matches of regexp outside of braces.
+
+        The brace depth is only counted up to each match, rather than
+        computed for every character of data.  None of the separators
+        contain braces.
+        """
+        parts, last, depth, counted = [], 0, 0, 0
         for m in regexp.finditer(data):
-            if depths[m.start()] == 0:
-                parts.append(data[last:m.start()])
+            start = m.start()
+            depth += data.count('{', counted, start) - data.count('}', counted, start)
+            counted = start
+            if depth == 0:
+                parts.append(data[last:start])
                 last = m.end()
                 if regexp.groups:
                     parts.extend(m.groups())
@@ -58,16 +70,24 @@ class NameParser:
         """Return the first character of data (in bibtex's sense)."""
         # XXX Should this be pulled out as some generic algorithm?
         pos = 0
-        depths = self.__depth(data)
+        if data[:1].isalpha():
+            # The common case
+            return data[0]
+        depths = None
         while True:
             if pos == len(data):
                 return ''
             elif data[pos].isalpha():
                 return data[pos]
-            elif data.startswith('{\\', pos):
+            elif data[pos] != '{':
+                pos += 1
+                continue
+            if depths is None:
+                depths = self.__depth(data)
+            if data.startswith('{\\', pos):
                 # Special character
                 pos += 1
-                m = re.compile(r'\\[a-zA-Z]+').match(data, pos)
+                m = CS_RE.match(data, pos)
                 if m and m.group() in _CONTROL_SEQS:
                     # Known bibtex control sequence
                     return _CONTROL_SEQS[m.group()]
@@ -76,12 +96,10 @@ class NameParser:
                     if data[pos].isalpha():
                         return data[pos]
                     pos += 1
-            elif data[pos] == '{':
+            else:
                 # Skip brace group
                 while pos < len(data) and depths[pos]:
                     pos += 1
-            else:
-                pos += 1
 
     def __split_von_last(self, toks):
         # See von_name_ends_and_last_name_starts_stuff
@@ -103,8 +121,7 @@ class NameParser:
         # See x_format_name
 
         # Split names (see name_scan_for_and)
-        name_strings = [n.strip() for n in self.__split_depth0(
-            '[ \t]and(?=[ \t])', string, flags=re.IGNORECASE)]
+        name_strings = [n.strip() for n in self.__split_depth0(_AND_RE, string)]
 
         # Process each name
         names = []
@@ -122,8 +139,8 @@ class NameParser:
             # Split on depth-0 commas and further split tokens in each
             # part, keeping only the first connector between each
             # token.
-            parts = [self.__split_depth0('([-~ \t])[-~ \t]*', part.strip())
-                     for part in self.__split_depth0(',', name_string)]
+            parts = [self.__split_depth0(_TOKEN_SEP_RE, part.strip())
+                     for part in self.__split_depth0(_COMMA_RE, name_string)]
 
             # Process name depending on how many commas there were
             first = von = last = jr = []
@@ -261,14 +278,53 @@ class Name(collections.namedtuple('Name', 'first von last jr')):
         pieces = pieces[first_field:last_field + 1]
         return leading + ''.join(pieces) + trailing
 
+# The number of name lists whose parses parse_names remembers
+NAME_CACHE_SIZE = 10000
+
+# Maps name list strings to their Names and the warnings about them,
+# in least recently used order
+_name_cache = collections.OrderedDict()
+
 def parse_names(string, pos=messages.Pos.unknown):
     """Parse a BibTeX name list (e.g., an author or editor field).
 
     Returns a list of Name objects.  The parsing is equivalent to
     BibTeX's built-in "format.name$" function.  Raises InputError if
     there is a syntax error.
+
+    The parses of the NAME_CACHE_SIZE most recently used strings are
+    cached, so parsing the same field again (or the same names in
+    another entry) is just a lookup.  Warnings are repeated for pos
+    every time.  Since the cache is keyed by the string itself, a
+    field that has been assigned a new value is simply parsed anew.
     """
-    return NameParser().parse(string, pos)
+    cached = _name_cache.get(string)
+    if cached is not None:
+        _name_cache.move_to_end(string)
+        names, warnings = cached
+        for msg in warnings:
+            pos.warn(msg)
+        return list(names)
+
+    recorder = _WarningRecorder(pos)
+    names = NameParser().parse(string, recorder)
+    _name_cache[string] = (tuple(names), tuple(recorder.warnings))
+    if len(_name_cache) > NAME_CACHE_SIZE:
+        _name_cache.popitem(last=False)
+    return names
+
+class _WarningRecorder:
+    """A stand-in for a Pos that also records the warnings logged to it."""
+
+    def __init__(self, pos):
+        self.__pos, self.warnings = pos, []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+        self.__pos.warn(msg)
+
+    def raise_error(self, msg):
+        self.__pos.raise_error(msg)
 
 _MONTHS = 'January February March April May June July August September October November December'.lower().split()
 
@@ -389,11 +445,14 @@ class TeXProcessor:
         self.__off = 0
         self.__pos = pos
 
-        # Process macros
+        # Process macros.  Expansions are not processed again, so the
+        # result can be built up from left to right.
+        out = []
         while True:
-            m = tex_cs_re.search(self.__data, self.__off)
+            m = tex_cs_re.search(string, self.__off)
             if not m:
                 break
+            out.append(string[self.__off:m.start()])
             self.__off = m.end()
             macro = m.group(1)
             nval = self._expand(macro)
@@ -403,11 +462,12 @@ class TeXProcessor:
                 else:
                     pos.warn('unknown special character `{}\''.format(macro))
                 nval = macro
-            self.__data = self.__data[:m.start()] + nval + \
-                          self.__data[self.__off:]
-            self.__off = m.start() + len(nval)
+            out.append(nval)
 
-        return self.__data
+        if not out:
+            return string
+        out.append(string[self.__off:])
+        return ''.join(out)
 
     def _scan_argument(self):
         """Scan and return a macro argument."""
@@ -458,6 +518,8 @@ class TeXProcessor:
         """
         return None
 
+_ESCAPED_SINGLE_CHAR_RE = re.compile(r'{(\w)}')
+
 class TeXToUnicode(TeXProcessor):
     """A simple TeX-to-unicode converter.
 
@@ -521,9 +583,9 @@ class TeXToUnicode(TeXProcessor):
         unicode_string = unicode_string.replace('---', '\u2014').replace('--', '\u2013')
 
         # Remove braces
-        escapedSingleCharRE = re.compile(r'{(\w)}')
         unicode_string = unicode_string.replace('{}', '')
-        unicode_string = escapedSingleCharRE.sub(r'\1', unicode_string)
+        if '{' in unicode_string:
+            unicode_string = _ESCAPED_SINGLE_CHAR_RE.sub(r'\1', unicode_string)
 
         return unicode_string
 
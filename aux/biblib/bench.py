@@ -0,0 +1,317 @@
+"""Micro-benchmarks for biblib.
+
+Run as
+
+    python -m biblib.bench [name ...]
+
+from the directory containing biblib to run the named benchmarks (or
+all of them).  Every benchmark prints one line per input size, so
+that it is easy to see how its cost grows with the size of the input.
+"""
+
+import sys
+import gc
+import time
+import random
+import os
+import io
+import tempfile
+import textwrap
+import collections
+import tracemalloc
+
+from . import bib, messages, algo
+
+BENCHMARKS = collections.OrderedDict()
+
+def benchmark(fn):
+    """Register fn as the benchmark named after it (minus bench_)."""
+    BENCHMARKS[fn.__name__[len('bench_'):]] = fn
+    return fn
+
+def best_time(fn, *args, repeat=3):
+    """Return the best wall clock time of repeat calls to fn(*args)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+WORDS = ('the of a model for {BibTeX} results we show that data {\\emph{new}} '
+         'method analysis $O(n^2)$ approach {{NASA}} based on using').split()
+
+def make_bib(n, seed=0, abstract_words=0):
+    """Return a synthetic .bib database with n entries.
+
+    If abstract_words is non-zero, every entry gets an abstract field
+    of about that many words.
+    """
+    rnd = random.Random(seed)
+    parts = ['@string{jour = {Journal of Synthetic Results}}\n\n']
+    for i in range(n):
+        parts.append('@article{key%d,\n'
+                     '  author = {Last%d, First and von Other, Jr, A. B.},\n'
+                     '  title = {A {T}itle about {\\"U}ber %d things},\n'
+                     '  journal = jour,\n'
+                     '  year = %d,\n'
+                     '  pages = {%d--%d},\n' % (i, i, i, 1950 + rnd.randrange(70),
+                                                i, i + rnd.randrange(1, 20)))
+        if abstract_words:
+            words = [rnd.choice(WORDS) for _ in range(abstract_words)]
+            for j in range(12, abstract_words, 12):
+                words[j] += '\n   '
+            parts.append('  abstract = {%s},\n' % ' '.join(words))
+        parts.append('}\n\n')
+    return ''.join(parts)
+
+def make_fields(n, seed=0):
+    """Yield (type, key, fields) for n synthetic database entries."""
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield ('article', 'key%d' % i,
+               [('author', 'Last%d, First and von Other, Jr, A. B.' % i),
+                ('title', 'A {T}itle about {\\"U}ber %d things' % i),
+                ('journal', 'Journal of Synthetic Results'),
+                ('year', str(1950 + rnd.randrange(70))),
+                ('pages', '%d--%d' % (i, i + rnd.randrange(1, 20)))])
+
+def report(label, n, total, count):
+    print('{:<28} n={:<8} {:10.3f} ms {:10.3f} us/op'.format(
+        label, n, total * 1e3, total * 1e6 / count))
+
+@benchmark
+def bench_positions(sizes=(1000, 10000, 50000)):
+    """Cost of PosFactory.offset_to_pos as the input grows.
+
+    Offsets are resolved both in increasing and in random order; the
+    per-lookup cost should stay flat in both cases.
+    """
+    for n in sizes:
+        text = make_bib(n)
+        offsets = [i for i, c in enumerate(text) if c == '@']
+        shuffled = list(offsets)
+        random.Random(0).shuffle(shuffled)
+        def resolve(offs):
+            factory = messages.PosFactory('bench.bib', text)
+            for off in offs:
+                factory.offset_to_pos(off)
+        report('positions (in order)', n, best_time(resolve, offsets),
+               len(offsets))
+        report('positions (random order)', n, best_time(resolve, shuffled),
+               len(offsets))
+
+@benchmark
+def bench_parse(sizes=(1000, 10000, 50000)):
+    """Parse throughput on short entries."""
+    for n in sizes:
+        text = make_bib(n)
+        total = best_time(lambda: bib.Parser().parse(text))
+        report('parse ({:.1f} MB/s)'.format(len(text) / total / 1e6),
+               n, total, n)
+
+@benchmark
+def bench_parse_abstracts(sizes=(100, 1000, 5000), abstract_words=250):
+    """Parse throughput on entries with long abstracts."""
+    for n in sizes:
+        text = make_bib(n, abstract_words=abstract_words)
+        total = best_time(lambda: bib.Parser().parse(text))
+        report('parse abstracts ({:.1f} MB/s)'.format(len(text) / total / 1e6),
+               n, total, n)
+
+@benchmark
+def bench_parse_lazy(sizes=(1000, 10000, 50000)):
+    """Parse throughput with Parser(lazy=True), looking up keys only."""
+    for n in sizes:
+        text = make_bib(n)
+        for lazy in (False, True):
+            def parse():
+                entries = bib.Parser(lazy=lazy).parse(text).get_entries()
+                return [entry.key for entry in entries.values()]
+            report('parse (lazy={})'.format(lazy), n, best_time(parse), n)
+
+@benchmark
+def bench_parse_mmap(sizes=(1000, 5000), abstract_words=250):
+    """Parser.parse on a text file versus Parser.parse_mmap.
+
+    Only the titles are looked up after parse_mmap, so the abstracts
+    are never decoded.  Peak memory is measured with tracemalloc.
+    """
+    for n in sizes:
+        fd, fname = tempfile.mkstemp(suffix='.bib')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            fp.write(make_bib(n, abstract_words=abstract_words))
+        def parse():
+            with open(fname, encoding='utf-8') as fp:
+                entries = bib.Parser().parse(fp).get_entries()
+            return [entry['title'] for entry in entries.values()]
+        def parse_mmap():
+            entries = bib.Parser().parse_mmap(fname).get_entries()
+            return [entry['title'] for entry in entries.values()]
+        for label, fn in (('parse file', parse), ('parse_mmap', parse_mmap)):
+            total = best_time(fn)
+            gc.collect()
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            report('{} ({:.0f} MB peak)'.format(label, peak / 1e6), n, total, n)
+        os.unlink(fname)
+
+@benchmark
+def bench_parse_retained(sizes=(1000, 5000), abstract_words=200, keep_every=140):
+    """Memory retained by the entries of a parse.
+
+    The file is parsed completely and streamed with iter_entries,
+    keeping every keep_every-th entry.  Only the memory still in use
+    once the parser and the input are gone is counted, as measured
+    with tracemalloc.
+    """
+    for n in sizes:
+        fd, fname = tempfile.mkstemp(suffix='.bib')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            fp.write(make_bib(n, abstract_words=abstract_words))
+        def parse():
+            with open(fname, encoding='utf-8') as fp:
+                return list(bib.Parser().parse(fp).get_entries().values())
+        def stream():
+            with open(fname, encoding='utf-8') as fp:
+                return [item for i, item in enumerate(bib.Parser().iter_entries(fp))
+                        if i % keep_every == 0]
+        for label, fn in (('parse', parse), ('iter_entries', stream)):
+            gc.collect()
+            tracemalloc.start()
+            kept = fn()
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print('{:<28} n={:<8} {:10.1f} MB {:10.1f} kB/kept entry'.format(
+                'retained ({})'.format(label), n, size / 1e6,
+                size / 1e3 / len(kept)))
+            del kept
+        os.unlink(fname)
+
+@benchmark
+def bench_parse_unterminated(sizes=(1000, 5000, 20000), chunk_size=4096):
+    """iter_entries on a file whose first entry has an unbalanced brace.
+
+    The entry only ends with the file, so it spans every chunk; the
+    cost per entry should stay flat as the file grows.
+    """
+    for n in sizes:
+        text = '@misc{bad, title={Unterminated\n' + make_bib(n)
+        def parse():
+            try:
+                list(bib.Parser().iter_entries(io.StringIO(text),
+                                               chunk_size=chunk_size))
+            except messages.InputError:
+                pass
+        report('parse unterminated', n, best_time(parse), n)
+
+@benchmark
+def bench_to_bib(sizes=(1000, 5000), abstract_words=100):
+    """Entry.to_bib, and word wrapping with textwrap.fill versus the
+    equivalent bib._fill that to_bib uses."""
+    for n in sizes:
+        entries = list(bib.Parser().parse(
+            make_bib(n, abstract_words=abstract_words)).get_entries().values())
+        values = [value for entry in entries for value in entry.values()
+                  if not value.isdigit()]
+        def textwrap_fill():
+            for value in values:
+                textwrap.fill(value, width=70, expand_tabs=False,
+                              replace_whitespace=False, break_long_words=False,
+                              break_on_hyphens=False,
+                              initial_indent='  title        = {',
+                              subsequent_indent='    ')
+        def fill():
+            for value in values:
+                bib._fill(value, 70, '  title        = {', '    ')
+        report('textwrap.fill', n, best_time(textwrap_fill), len(values))
+        report('_fill', n, best_time(fill), len(values))
+        for width in (70, None):
+            def to_bib():
+                for entry in entries:
+                    entry.to_bib(wrap_width=width)
+            report('to_bib (wrap_width={})'.format(width), n,
+                   best_time(to_bib), n)
+
+ACCENTED = ('{\\"o}', "\\'e", '\\`a', '\\c{c}', '\\v{s}', '{\\ss}', '\\~n',
+            '\\^{\\i}', '{\\o}', '---', 'M{\\"u}ller', 'Jos\\\'e', 'and', 'the')
+
+@benchmark
+def bench_tex_to_unicode(sizes=(10, 100, 1000, 10000), count=10000):
+    """algo.tex_to_unicode on accent-dense fields of growing length.
+
+    Every field has n words, most of which contain a macro.  The cost
+    per word should stay flat as the fields get longer.
+    """
+    rnd = random.Random(0)
+    for n in sizes:
+        fields = [' '.join(rnd.choice(ACCENTED) for _ in range(n))
+                  for _ in range(max(1, count // n))]
+        def convert():
+            for field in fields:
+                algo.tex_to_unicode(field)
+        report('tex_to_unicode', n, best_time(convert), n * len(fields))
+
+AUTHORS = ('Aad, G.', 'M{\\"u}ller, Jos\\\'e', 'van der Berg, J. P.',
+           'Abbott, Jr., B.', '{\\O}stergaard, N.', 'de la Cruz-Burelo, E.',
+           'Kim, S.-H.', '{ATLAS Collaboration}', 'Lee, {\\relax Ch}ristina')
+
+@benchmark
+def bench_parse_names(sizes=(10, 100, 500, 3000), count=30000):
+    """NameParser.parse on author lists of n names.
+
+    Large collaborations routinely list thousands of authors.  This
+    bypasses parse_names' cache, and the cost per name should stay
+    flat as the lists get longer.
+    """
+    rnd = random.Random(0)
+    for n in sizes:
+        lists = [' and '.join(rnd.choice(AUTHORS) for _ in range(n))
+                 for _ in range(max(1, count // n))]
+        def parse():
+            for names in lists:
+                algo.NameParser().parse(names, messages.Pos.unknown)
+        report('parse names', n, best_time(parse), n * len(lists))
+
+@benchmark
+def bench_entry_memory(n=100000):
+    """Memory retained by n Entry and CompactEntry objects.
+
+    The field values are shared by both runs and not counted.  Field
+    names and types are fresh strings for every entry, as they are
+    when parsing.
+    """
+    records = list(make_fields(n))
+    for cls in (bib.Entry, bib.CompactEntry):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        entries = []
+        for typ, key, fields in records:
+            fields = [(field.lower(), value) for field, value in fields]
+            field_pos = {field: messages.Pos.unknown for field, _ in fields}
+            entries.append(cls(fields, typ.lower(), key, None, field_pos))
+        elapsed = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('{:<28} n={:<8} {:10.1f} MB {:10.1f} bytes/entry {:10.3f} s'.format(
+            'memory ({})'.format(cls.__name__), n, size / 1e6, size / n,
+            elapsed))
+        del entries
+
+def main(argv=sys.argv[1:]):
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit('unknown benchmark {!r}; choose from {}'.format(
+                name, ', '.join(BENCHMARKS)))
+    for name in names:
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main()
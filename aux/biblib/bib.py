@@ -6,29 +6,198 @@ especially section "Reading the database file(s)" -- and hence
 own parser.
 """
 
-__all__ = 'Parser Entry FieldError resolve_crossrefs'.split()
+__all__ = 'Parser Entry CompactEntry LazyEntry CrossrefView String Preamble FieldError resolve_crossrefs'.split()
 
 import sys
+import os
+import io
 import re
 import collections
-import textwrap
+import collections.abc
+import concurrent.futures
+import itertools
+import bisect
+import hashlib
+import mmap
 
 from . import messages
 
 # Match sequences of legal identifier characters, except that the
 # first is not allowed to be a digit (see id_class)
-ID_RE = re.compile('(?![0-9])(?:(?![ \t"#%\'(),={}])[\x20-\x7f])+')
+ID_CHAR = '(?![ \t"#%\'(),={}])[\x20-\x7f]'
+ID_RE = re.compile('(?![0-9])(?:%s)+' % ID_CHAR)
 # BibTeX only considers space, tab, and newline to be white space (see
 # lex_class)
 SPACE_RE = re.compile('[ \t\n]*')
 
+# Match the characters _scan_balanced_text has to look at for each
+# terminator
+BALANCED_RES = {'}': re.compile('[{}]'), '"': re.compile('[{}"]')}
+
+# The remaining tokens scanned by Parser, compiled once.  The key of
+# a database entry is anything up to a comma, white space, or
+# end-of-line, and for an entry in braces, also up to a right brace.
+NOISE_RE = re.compile('[^@]*')
+AT_RE = re.compile('@')
+LEFT_RE = re.compile('[{(]')
+RIGHT_RES = {'(': re.compile('\\)'), '{': re.compile('}')}
+KEY_RES = {'(': re.compile('[^, \t\n]*'), '{': re.compile('[^, \t}\n]*')}
+COMMA_RE = re.compile(',')
+EQUALS_RE = re.compile('=')
+HASH_RE = re.compile('#')
+NUMBER_RE = re.compile('[0-9]+')
+# Runs of white space that BibTeX compresses to a single space in
+# field values, and trailing white space on a line
+SPACE_RUN_RE = re.compile('[ \t\n]+')
+TRAILING_SPACE_RE = re.compile('[ \t]+$', re.MULTILINE)
+# The runs of white space at which _fill breaks lines (the same as
+# textwrap's)
+WRAP_SPACE_RE = re.compile('([\t\n\x0b\x0c\r ]+)')
+
+# Match a field whose value is a single piece (with braces nested at
+# most three deep) for Parser._index_fields, including the comma
+# before it and the white space after it.  Anything else is left to
+# the regular tokens.
+_BRACED = '[^{}]*'
+for _ in range(2):
+    _BRACED = '[^{}]*(?:{%s}[^{}]*)*' % _BRACED
+INDEX_FIELD_RE = re.compile(
+    ',[ \t\n]*(?P<field>{id})[ \t\n]*=[ \t\n]*'
+    '(?:{{{braced}}}|"[^"{{}}]*(?:{{{braced}}}[^"{{}}]*)*"|[0-9]+(?![0-9])|'
+    '(?P<macro>{id})(?!{id_char}))'
+    '(?![ \t\n]*#)[ \t\n]*'.format(
+        id=ID_RE.pattern, id_char=ID_CHAR, braced=_BRACED))
+del _BRACED, _
+
+# Match the start of an @string command
+STRING_CMD_RE = re.compile('@[ \t\n]*string[ \t\n]*[{(]', re.IGNORECASE)
+
+# Tokens scanned by Parser.parse_mmap in raw bytes.  A carriage return
+# counts as white space, since it would have become a newline in a
+# file opened in text mode.
+BYTES_ID_RE = re.compile(ID_RE.pattern.encode('ascii'))
+BYTES_SPACE_RE = re.compile(b'[ \t\r\n]*')
+BYTES_BALANCED_RES = {b'}': re.compile(b'[{}]'), b'"': re.compile(b'[{}"]')}
+BYTES_KEY_RES = {b'(': re.compile(b'[^, \t\r\n]*'),
+                 b'{': re.compile(b'[^, \t}\r\n]*')}
+BYTES_NUMBER_RE = re.compile(b'[0-9]+')
+
+# Number of characters Parser.iter_entries reads from a file at a time
+CHUNK_SIZE = 1 << 20
+# Number of characters after which Parser.iter_entries gives up on a
+# command or entry that is still not complete, such as one with an
+# unbalanced brace, rather than buffering the rest of the file
+MAX_ITEM_SIZE = 1 << 24
+# Number of shards per worker process used by Parser.parse_parallel
+SHARDS_PER_PROCESS = 4
+# Number of records of the previous parse an incremental parse checks
+# for a match at every entry, so that up to this many deleted entries
+# do not make it lose track
+REUSE_LOOKAHEAD = 8
+
 class ParseError(Exception):
     pass
 
+class _NeedMoreData(Exception):
+    """The scanner ran into the end of the current input chunk."""
+    pass
+
+class _DeferredLog:
+    """A log file wrapper that can hold back messages.
+
+    While holding, messages are buffered until they are either
+    released to the underlying log or discarded.  This lets the
+    parser retry an entry that was cut off at a chunk boundary without
+    logging its warnings twice.
+    """
+
+    def __init__(self, fp):
+        self.__fp, self.__held = fp, None
+
+    def write(self, msg):
+        if self.__held is None:
+            self.__fp.write(msg)
+        else:
+            self.__held.append(msg)
+
+    def hold(self):
+        self.__held = []
+
+    def release(self):
+        held, self.__held = self.__held, None
+        for msg in held:
+            self.__fp.write(msg)
+
+    def discard(self):
+        self.__held = None
+
+# Log files of the current parse_parallel calls, by _ShardLog token
+_shard_logs = {}
+
+class _ShardLog:
+    """A picklable stand-in for the log file of a parse_parallel call.
+
+    Worker processes point it at a buffer that is sent back with their
+    results.  In the parent process it writes to the real log file.
+    """
+
+    __tokens = itertools.count()
+
+    def __init__(self):
+        self.token = (os.getpid(), next(self.__tokens))
+
+    def write(self, msg):
+        _shard_logs[self.token].write(msg)
+
+def _rebind_log(entry, log_fp):
+    """Point the positions of an entry from parse_parallel at log_fp.
+
+    Entries come back from the worker processes with _ShardLog
+    positions, which only work during their parse_parallel call (and
+    in the process that made it).
+    """
+    entry.pos = entry.pos._replace(log_fp=log_fp)
+    if not isinstance(entry, LazyEntry):
+        # Lazy entries are unpickled unscanned and derive their field
+        # positions from pos
+        entry.field_pos = {field: pos._replace(log_fp=log_fp)
+                           for field, pos in entry.field_pos.items()}
+
+def _rebind_error_log(errors, log_fp):
+    """Return a copy of InputError arguments with positions rebound to
+    log_fp, like _rebind_log."""
+    return [(error[0]._replace(log_fp=log_fp), error[1])
+            if isinstance(error, tuple) else _rebind_error_log(error, log_fp)
+            for error in errors]
+
+class _Record(collections.namedtuple(
+        '_Record', 'start end fingerprint item key macros')):
+    """What an incremental Parser remembers about a scanned item.
+
+    start and end give the span of the item's text in its input,
+    fingerprint is a digest of that text, key is the entry key before
+    any repeated key renaming, and macros maps every macro the item
+    referenced to the value it had at the time (or None).
+    """
+
+# Returned by Parser._skim_command_or_entry for text that needs the
+# regular parser
+_HAND_OFF = object()
+
+# Returned by Parser._scan_command_or_entry for an entry that is not
+# wanted
+_SKIPPED = object()
+
+def _fingerprint(text):
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'),
+                           digest_size=16).digest()
+
 class Parser:
     """A parser for .bib BibTeX database files."""
 
-    def __init__(self, *, month_style='full', repeatKeySuffix=None):
+    def __init__(self, *, month_style='full', repeatKeySuffix=None,
+                 incremental=False, entry_class=None, keys=None, lazy=False,
+                 keep_source=False):
         """Initialize an empty database.
 
         This also initializes standard month macros (which are usually
@@ -36,6 +205,31 @@ class Parser:
         full names, 'abbrv' to get abbrv.bst-style abbreviated names,
         or None to not initialize month macros.
 
+        If incremental is True, the parser remembers the span, a
+        fingerprint and the macro dependencies of everything it
+        parses, so that a later parse of an edited version of the same
+        input can reuse the unchanged entries (see parse).
+
+        entry_class is the class used for database entries, Entry by
+        default.  CompactEntry needs considerably less memory for
+        large databases.
+
+        If keys is not None, only entries whose (case-insensitive) key
+        is in keys, and the entries they cross-reference, are kept.
+        The fields of all other entries are skipped without building
+        their values.  @string commands are processed regardless.
+        Cross-referenced entries are only found if they come after the
+        entries that refer to them, as BibTeX requires.
+
+        If lazy is True, entries are only checked for errors and
+        warnings at first, and the database is made of LazyEntry
+        objects that keep the text of each entry and build its fields
+        when they are first used.  This cannot be combined with
+        incremental.
+
+        If keep_source is True, the parser also keeps the text of
+        every entry, which get_sources returns.
+
         The database should be populated by calling parse one or more
         times.  The final contents of the database can be retrieved by
         calling finalize.
@@ -43,6 +237,17 @@ class Parser:
 
         self.__log, self.__errors = [], False
         self.__entries = collections.OrderedDict()
+        self.__keys, self.__unique_keys = set(), True
+        self.__incremental, self.__records = incremental, []
+        self.__entry_class = entry_class or Entry
+        self.__previous, self.__macro_deps = None, {}
+        self.__wanted_keys = None if keys is None else {k.lower() for k in keys}
+        self.__skipped = 0
+        if lazy and incremental:
+            raise ValueError('lazy and incremental parsing cannot be combined')
+        self.__lazy = lazy
+        self.__keep_source, self.__sources = keep_source, {}
+        self.__last_source = None
 
         self.__repeatKeySuffix = repeatKeySuffix
         self.__key2repeatKeys = {}
@@ -70,7 +275,8 @@ class Parser:
         """Declare a macro, just like an @string command."""
         self.__macros[name] = value
 
-    def parse(self, str_or_fp_or_iter, name=None, *, log_fp=None):
+    def parse(self, str_or_fp_or_iter, name=None, *, log_fp=None,
+              previous=None):
         """Parse the contents of str_or_fp_or_iter and return self.
 
         str_or_fp_or_iter must be a string, a file-like object, or an
@@ -91,40 +297,693 @@ class Parser:
         Parse can be called multiple times to parse subsequent .bib
         files.  Later files will have access to, for example, strings
         defined in earlier files.
+
+        If previous is an incremental Parser that parsed an earlier
+        version of the same input, every command or entry whose text
+        and macro dependencies are unchanged is taken over from
+        previous rather than scanned again.  Reused Entry objects are
+        shared with previous (with their positions and keys updated),
+        so previous should be discarded afterwards.  Warnings about
+        reused entries are not repeated.
         """
 
         recoverer = messages.InputErrorRecoverer()
-        if isinstance(str_or_fp_or_iter, str):
-            self.__data = str_or_fp_or_iter
-            fname = name or '<string>'
-        elif isinstance(str_or_fp_or_iter, collections.Iterable) and \
-             not hasattr(str_or_fp_or_iter, 'read'):
+        if not isinstance(str_or_fp_or_iter, str) and \
+           isinstance(str_or_fp_or_iter, collections.abc.Iterable) and \
+           not hasattr(str_or_fp_or_iter, 'read'):
             for obj in str_or_fp_or_iter:
                 with recoverer:
-                    self.parse(obj, name=name, log_fp=log_fp)
+                    self.parse(obj, name=name, log_fp=log_fp,
+                               previous=previous)
             recoverer.reraise()
             return self
+
+        with recoverer:
+            for item in self.iter_entries(str_or_fp_or_iter, name,
+                                          log_fp=log_fp, previous=previous):
+                if isinstance(item, _ENTRY_CLASSES):
+                    self.__entries[item.key.lower()] = item
+        recoverer.reraise()
+        return self
+
+    def iter_entries(self, str_or_fp, name=None, *, log_fp=None,
+                     chunk_size=CHUNK_SIZE, line=1, col=0, previous=None):
+        """Parse str_or_fp incrementally and yield its contents.
+
+        str_or_fp must be a string or a file-like object.  File-like
+        objects are read chunk_size characters at a time and only the
+        text of the command or entry currently being scanned is kept
+        in memory, so arbitrarily large databases can be processed in
+        constant space.  A command or entry that is not complete after
+        MAX_ITEM_SIZE characters of a file is reported as an error, and
+        scanning resumes after its @.  name, log_fp and previous are as
+        for parse.
+        line and col give the position of the first character of
+        str_or_fp.
+
+        Yields an Entry for every database entry, a String for every
+        @string command and a Preamble for every @preamble command, in
+        input order.  Macros and repeated keys are handled exactly as
+        by parse, but entries are *not* added to the database returned
+        by get_entries.
+
+        If there are any errors in the input, raises a (potentially
+        bundled) InputError once the input is exhausted.
+        """
+
+        if isinstance(str_or_fp, str):
+            self.__fname = name or '<string>'
+            chunks, pending = iter(()), str_or_fp
         else:
-            self.__data = str_or_fp_or_iter.read()
             try:
-                fname = name or str_or_fp_or_iter.name
+                self.__fname = name or str_or_fp.name
             except AttributeError:
-                fname = '<unknown>'
-        self.__off = 0
+                self.__fname = '<unknown>'
+            chunks, pending = iter(lambda: str_or_fp.read(chunk_size), ''), ''
+        self.__chunks, self.__pending = chunks, pending
+        self.__log = None if log_fp is None else _DeferredLog(log_fp)
+        self.__data, self.__off, self.__base = '', 0, (line, col)
+        self.__eof = self.__hit_eof = False
+        self.__consumed = 0
+        if previous is not None and previous is not self.__previous:
+            self.__previous, self.__previous_idx = previous, 0
+        self.__pos_factory = None
+        self._read_chunk()
+        try:
+            yield from self.__iter_items()
+        finally:
+            self.__pos_factory.release()
+
+    def __iter_items(self):
+
+        recoverer = messages.InputErrorRecoverer()
+        while True:
+            # Skip inter-entry noise before remembering where the
+            # entry starts, so it never has to be scanned twice
+            self._try_tok(NOISE_RE)
+            if self.__off >= len(self.__data):
+                if self.__eof:
+                    break
+                self._read_chunk()
+                continue
+
+            start, item = self.__off, None
+            deferring = self.__log is not None and not self.__eof
+            if deferring:
+                self.__log.hold()
+            try:
+                # Just continue to the next entry if there's an error
+                with recoverer:
+                    item = self._reuse()
+                    if item is None:
+                        self.__macro_deps = {}
+                        item = self._scan_command_or_entry()
+                        if not self.__eof and self.__off >= len(self.__data):
+                            # The entry may continue in the next chunk
+                            raise _NeedMoreData()
+                        if item is _SKIPPED:
+                            self.__skipped += 1
+                            item = None
+                        key = getattr(item, 'key', None)
+                        item = self._commit(item)
+                        self._record(start, item, key)
+                        self._keep_source(start, item, key)
+            except _NeedMoreData:
+                if deferring:
+                    self.__log.discard()
+                size = len(self.__data) - start
+                if size < MAX_ITEM_SIZE:
+                    # Read at least as much again, so that an item
+                    # spanning many chunks is not rescanned for each
+                    self.__off = start
+                    self._read_chunk(size)
+                    continue
+                self.__off = start + 1
+                with recoverer:
+                    self._fail('command or entry too long', start)
+                continue
+            if deferring:
+                self.__log.release()
+            if item is not None:
+                try:
+                    yield item
+                except GeneratorExit:
+                    # The caller stopped early
+                    recoverer.dispose()
+                    raise
+        recoverer.reraise()
+
+    def _read_chunk(self, size=0):
+        """Drop consumed text and append the next chunk of input.
+
+        More chunks are appended until at least size characters were
+        read.
+        """
+        if self.__pos_factory is not None:
+            # Positions handed out so far must not keep the old text
+            # alive
+            self.__pos_factory.release()
+        if self.__off:
+            pos = self.__pos_factory.offset_to_pos(self.__off)
+            self.__consumed += self.__off
+            self.__data = self.__data[self.__off:]
+            self.__off = 0
+            self.__base = (pos.line, pos.col)
+
+        chunks = [next(self.__chunks, '')]
+        read = len(chunks[0])
+        while chunks[-1] and read < size:
+            chunks.append(next(self.__chunks, ''))
+            read += len(chunks[-1])
+        if not chunks[-1]:
+            self.__eof = True
+        text = self.__pending + ''.join(chunks)
+        if self.__eof:
+            self.__pending = ''
+        else:
+            # Only hand complete lines to the scanner
+            split = text.rfind('\n') + 1
+            text, self.__pending = text[:split], text[split:]
 
         # Remove trailing whitespace from lines in data (see input_ln
         # in bibtex.web)
-        self.__data = re.sub('[ \t]+$', '', self.__data, flags=re.MULTILINE)
-        self.__pos_factory = messages.PosFactory(fname, self.__data, log_fp)
+        text = TRAILING_SPACE_RE.sub('', text)
+        self.__data += text
+        line, col = self.__base
+        self.__pos_factory = messages.PosFactory(
+            self.__fname, self.__data, self.__log, line=line, col=col)
+
+    def _record(self, start, item, key):
+        """Remember a committed item for later incremental parses."""
+        if self.__incremental and item is not None:
+            text = self.__data[start:self.__off]
+            self.__records.append(_Record(
+                self.__consumed + start, self.__consumed + self.__off,
+                _fingerprint(text), item, key, self.__macro_deps))
+
+    def _keep_source(self, start, item, key):
+        """Remember the text of a committed entry for get_sources."""
+        self.__last_source = None
+        if self.__keep_source and isinstance(item, _ENTRY_CLASSES) and \
+           self._is_self_contained():
+            text = self.__data[start:self.__off].rstrip(' \t\n')
+            self._add_source(item, key, text)
+
+    def _is_self_contained(self):
+        """Return whether the last entry refers to no macros except
+        the month macros BibTeX predefines.
+
+        The text of other entries means something else without the
+        @string commands it depends on.
+        """
+        return all(macro in MONTH_MACROS for macro in self.__macro_deps)
+
+    def _add_source(self, item, key, text):
+        self.__last_source = text
+        if item.key == key:
+            # A renamed entry has to be written with its new key
+            self.__sources[item.key.lower()] = text
+
+    def _reuse(self):
+        """Take over the item at the current offset from the previous parse.
+
+        Returns the committed item, or None if the text at the current
+        offset does not match any of the next few items of the
+        previous parse or the macros it uses have changed.
+        """
+        if self.__previous is None:
+            return None
+        records = self.__previous.__records
+        start = self.__off
+        for i in range(self.__previous_idx,
+                       min(self.__previous_idx + REUSE_LOOKAHEAD, len(records))):
+            rec = records[i]
+            end = start + rec.end - rec.start
+            if end > len(self.__data) or \
+               _fingerprint(self.__data[start:end]) != rec.fingerprint:
+                continue
+            self.__previous_idx = i + 1
+            for macro, value in rec.macros.items():
+                if self.__macros.get(macro) != value:
+                    # Same text, but it has to be expanded again
+                    return None
+
+            item = self._move(rec.item, start)
+            if isinstance(item, _ENTRY_CLASSES):
+                item.key = rec.key
+            self.__off, self.__macro_deps = end, rec.macros
+            item = self._commit(item)
+            self._record(start, item, rec.key)
+            self._keep_source(start, item, rec.key)
+            return item
+        return None
+
+    def _move(self, item, start):
+        """Update the positions of a reused item that now starts at start."""
+        factory = self.__pos_factory
+        pos = factory.offset_to_lazy_pos(start)
+        if not isinstance(item, _ENTRY_CLASSES):
+            return item._replace(pos=pos)
+
+        # Positions of an entry are all relative to the same string
+        shift = start - item.pos.offset
+        item.field_pos = {field: factory.offset_to_lazy_pos(fpos.offset + shift)
+                          for field, fpos in item.field_pos.items()}
+        item.pos = pos
+        return item
+
+    def _commit(self, item):
+        """Record the effects of a completely scanned command or entry."""
+        if isinstance(item, String):
+            self.__macros[item.name] = item.value
+        elif isinstance(item, _ENTRY_CLASSES) and self.__unique_keys:
+            key = item.key
+            if key.lower() in self.__keys:
+                if self.__repeatKeySuffix is None:
+                    self._fail('repeated entry')
+                else:
+                    repeatKeys = self.__key2repeatKeys.setdefault(key, {key})
+                    while True:
+                        key += self.__repeatKeySuffix
+                        if key not in repeatKeys:
+                            repeatKeys.add(key)
+                            break
+                item.key = key
+            self.__keys.add(key.lower())
+        return item
+
+    def parse_parallel(self, str_or_fp, name=None, *, log_fp=None,
+                       processes=None):
+        """Parse str_or_fp using a pool of worker processes and return self.
+
+        The input is split into shards at lines starting with @, which
+        are parsed concurrently by processes worker processes (by
+        default, one per CPU).  The results are merged in input order
+        so that the database, macros, repeated key renaming, and log
+        output are identical to those of parse.  Each shard is parsed
+        with the macros defined before it, which are collected by a
+        quick scan for @string commands beforehand.
+
+        If a shard boundary turns out not to lie between two entries
+        (for example, because a field value contains a line starting
+        with @), this falls back to a serial parse.
+
+        name and log_fp are as for parse.  Only a single string or
+        file-like object is supported.
+        """
+
+        if isinstance(str_or_fp, str):
+            data, fname = str_or_fp, name or '<string>'
+        else:
+            data = str_or_fp.read()
+            try:
+                fname = name or str_or_fp.name
+            except AttributeError:
+                fname = '<unknown>'
+
+        processes = processes or os.cpu_count() or 1
+        bounds = self._shard_bounds(data, processes * SHARDS_PER_PROCESS)
+        if len(bounds) < 3:
+            return self.parse(data, fname, log_fp=log_fp)
+
+        # Collect the macros visible at the start of each shard
+        shard_macros, shard_strings = self._scan_shard_macros(data, bounds)
+
+        if log_fp is None:
+            log = None
+        else:
+            log = _ShardLog()
+            _shard_logs[log.token] = log_fp
+        try:
+            return self.__parse_shards(data, fname, bounds, shard_macros,
+                                       shard_strings, log_fp, log, processes)
+        finally:
+            if log is not None:
+                del _shard_logs[log.token]
+
+    def __parse_shards(self, data, fname, bounds, shard_macros, shard_strings,
+                       log_fp, log, processes):
+        shards, line = [], 1
+        for i in range(len(bounds) - 1):
+            text = data[bounds[i]:bounds[i+1]]
+            shards.append((text, fname, line, shard_macros[i], log,
+                           self.__entry_class, self.__wanted_keys, self.__lazy,
+                           self.__keep_source))
+            line += text.count('\n')
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(Parser._parse_shard, shards))
+
+        # Check that the shards really were parsed like a serial parse
+        # would have parsed them
+        keys = set(self.__keys)
+        for i, (items, _, _, hit_eof, _, _) in enumerate(results):
+            strings = [item[:2] for item in items if isinstance(item, String)]
+            if (hit_eof and i < len(results) - 1) or strings != shard_strings[i]:
+                return self.parse(data, fname, log_fp=log_fp)
+            if self.__repeatKeySuffix is None:
+                for item in items:
+                    if isinstance(item, _ENTRY_CLASSES):
+                        if item.key.lower() in keys:
+                            # Let the serial parser report it
+                            return self.parse(data, fname, log_fp=log_fp)
+                        keys.add(item.key.lower())
+            if self.__wanted_keys is not None and i < len(results) - 1:
+                for item in items:
+                    if isinstance(item, _ENTRY_CLASSES) and 'crossref' in item \
+                       and item['crossref'].lower() not in self.__wanted_keys:
+                        # A later shard may have skipped the target
+                        return self.parse(data, fname, log_fp=log_fp)
+
+        errors = []
+        for items, log_text, shard_errors, _, sources, skipped in results:
+            self.__skipped += skipped
+            if log_fp is not None:
+                log_fp.write(log_text)
+                shard_errors = _rebind_error_log(shard_errors, log_fp)
+            errors.extend(shard_errors)
+            for item, source in zip(items, sources):
+                key = getattr(item, 'key', None)
+                item = self._commit(item)
+                if isinstance(item, _ENTRY_CLASSES):
+                    if log_fp is not None:
+                        _rebind_log(item, log_fp)
+                    if source is not None:
+                        self._add_source(item, key, source)
+                    self.__entries[item.key.lower()] = item
+                    if self.__wanted_keys is not None and 'crossref' in item:
+                        self.__wanted_keys.add(item['crossref'].lower())
+        if errors:
+            # Bundle the errors the same way parse does
+            raise messages.InputError([errors])
+        return self
 
-        # Parse entries
-        while self.__off < len(self.__data):
-            # Just continue to the next entry if there's an error
+    @staticmethod
+    def _shard_bounds(data, shards):
+        """Return offsets that split data into about shards pieces.
+
+        Every piece except the first starts at the beginning of a line
+        that starts with @.
+        """
+        bounds = [0]
+        for i in range(1, shards):
+            off = data.find('\n@', max(bounds[-1], len(data) * i // shards))
+            if off == -1:
+                break
+            if off + 1 > bounds[-1]:
+                bounds.append(off + 1)
+        bounds.append(len(data))
+        return bounds
+
+    def _scan_shard_macros(self, data, bounds):
+        """Evaluate @string commands in data in order.
+
+        Returns a list of the macros defined at the start of each
+        shard and a list of the (name, value) pairs of the @string
+        commands found in each shard.
+        """
+        scanner = Parser(month_style=None)
+        for macro, value in self.__macros.items():
+            scanner.string(macro, value)
+        shard_macros = [dict(self.__macros)]
+        shard_strings = [[] for i in range(len(bounds) - 1)]
+        shard = 0
+        for m in STRING_CMD_RE.finditer(data):
+            while m.start() >= bounds[shard+1]:
+                shard += 1
+                shard_macros.append(dict(scanner.__macros))
+            end = data.find('\n@', m.end())
+            items = scanner.iter_entries(data[m.start():end if end != -1 else len(data)])
+            recoverer = messages.InputErrorRecoverer()
+            item = None
             with recoverer:
-                self._scan_command_or_entry()
-        recoverer.reraise()
+                item = next(items, None)
+            recoverer.dispose()
+            items.close()
+            if isinstance(item, String):
+                shard_strings[shard].append(item[:2])
+        while len(shard_macros) < len(bounds) - 1:
+            shard_macros.append(dict(scanner.__macros))
+        return shard_macros, shard_strings
+
+    @classmethod
+    def _parse_shard(cls, shard):
+        """Parse one shard for parse_parallel in a worker process.
+
+        Returns the scanned items, the log output, the InputErrors,
+        whether the scanner ran into the end of the shard in the
+        middle of a command or entry, the text of each item if
+        keep_source is True, and the number of skipped entries.
+        """
+        text, fname, line, macros, log, entry_class, keys, lazy, keep_source = shard
+        parser = cls(month_style=None, entry_class=entry_class, keys=keys,
+                     lazy=lazy, keep_source=keep_source)
+        for macro, value in macros.items():
+            parser.string(macro, value)
+        if log is not None:
+            log_fp = _shard_logs[log.token] = io.StringIO()
+
+        # Keys are made unique when the shards are merged
+        parser.__unique_keys, items, errors, sources = False, [], [], []
+        try:
+            for item in parser.iter_entries(text, fname, log_fp=log, line=line):
+                items.append(item)
+                sources.append(parser.__last_source)
+        except messages.InputError as e:
+            errors = e.args[0]
+        finally:
+            if log is not None:
+                del _shard_logs[log.token]
+        log_text = '' if log is None else log_fp.getvalue()
+        return (items, log_text, errors, parser.__hit_eof, sources,
+                parser.__skipped)
+
+    def parse_mmap(self, filename, *, encoding='utf-8', log_fp=None):
+        """Parse the file filename by memory-mapping it and return self.
+
+        Rather than decoding the whole file, this scans its raw bytes
+        for the structure of the database.  Only entry keys are
+        decoded right away: the database is made of CompactEntry
+        objects whose field values are decoded the first time they
+        are looked up, so fields that are never used are never
+        decoded.  The file stays mapped as long as any of these values
+        is left.  Its encoding must be ASCII-compatible, like UTF-8 or
+        Latin-1.
+
+        Commands, and entries that refer to unknown macros, repeat a
+        field, or are malformed, are decoded and handed to the regular
+        parser.  Error recovery after a malformed entry resumes at the
+        next line starting with @.
+
+        log_fp is as for parse.
+        """
+
+        with open(filename, 'rb') as fp:
+            try:
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return self.parse('', filename, log_fp=log_fp)
+        factory = messages.BufferPosFactory(filename, buf, encoding, log_fp)
+
+        errors, off = [], 0
+        while True:
+            start = buf.find(b'@', off)
+            if start == -1:
+                break
+            self.__macro_deps = {}
+            item, off = self._skim_command_or_entry(buf, start, factory,
+                                                    encoding)
+            if isinstance(item, CompactEntry) and \
+               self.__repeatKeySuffix is None and item.key.lower() in self.__keys:
+                # Let the regular parser report it
+                item = _HAND_OFF
+            if item is _HAND_OFF:
+                if off is None:
+                    off = buf.find(b'\n@', start) + 1 or len(buf)
+                pos = factory.offset_to_pos(start)
+                text = _translate_newlines(buf[start:off].decode(encoding))
+                try:
+                    for item in self.iter_entries(
+                            text, filename, log_fp=log_fp,
+                            line=pos.line, col=pos.col):
+                        if isinstance(item, _ENTRY_CLASSES):
+                            self.__entries[item.key.lower()] = item
+                except messages.InputError as e:
+                    errors.extend(e.args[0])
+            elif item is not None:
+                key = item.key
+                item = self._commit(item)
+                if self.__keep_source and self._is_self_contained():
+                    self._add_source(item, key, _translate_newlines(
+                        buf[start:off].decode(encoding)).rstrip(' \t\n'))
+                self.__entries[item.key.lower()] = item
+        if errors:
+            # Bundle the errors the same way parse does
+            raise messages.InputError([errors])
         return self
 
+    def _skim_command_or_entry(self, buf, start, factory, encoding):
+        """Scan the command or entry at buf[start] for parse_mmap.
+
+        Returns the scanned item and the offset following it.  The item
+        is a CompactEntry of _LazyValues, None for an @comment or a
+        skipped entry, or _HAND_OFF if the regular parser has to scan
+        the text.  The offset is None if the text is malformed.
+        """
+        space = BYTES_SPACE_RE.match
+        m = BYTES_ID_RE.match(buf, space(buf, start + 1).end())
+        if m is None:
+            return _HAND_OFF, None
+        typ = m.group().decode('ascii').lower()
+        if typ == 'comment':
+            return None, m.end()
+
+        off = space(buf, m.end()).end()
+        left = buf[off:off+1]
+        if left != b'{' and left != b'(':
+            return _HAND_OFF, None
+        right = b')' if left == b'(' else b'}'
+        off = space(buf, off + 1).end()
+
+        if typ == 'preamble' or typ == 'string':
+            # These are rare, so only find where they end
+            if typ == 'string':
+                m = BYTES_ID_RE.match(buf, off)
+                if m is None:
+                    return _HAND_OFF, None
+                off = space(buf, m.end()).end()
+                if buf[off:off+1] != b'=':
+                    return _HAND_OFF, None
+                off = space(buf, off + 1).end()
+            _, off = self._skim_field_value(buf, off)
+            if off is None or buf[off:off+1] != right:
+                return _HAND_OFF, None
+            return _HAND_OFF, off + 1
+
+        m = BYTES_KEY_RES[left].match(buf, off)
+        key = m.group().decode(encoding)
+        off = space(buf, m.end()).end()
+
+        fields, field_pos, hand_off = [], {}, False
+        while True:
+            if buf[off:off+1] == right:
+                break
+            if buf[off:off+1] != b',':
+                return _HAND_OFF, None
+            off = space(buf, off + 1).end()
+            if buf[off:off+1] == right:
+                break
+
+            field_off = off
+            m = BYTES_ID_RE.match(buf, off)
+            if m is None:
+                return _HAND_OFF, None
+            field = m.group().decode('ascii').lower()
+            off = space(buf, m.end()).end()
+            if buf[off:off+1] != b'=':
+                return _HAND_OFF, None
+            pieces, off = self._skim_field_value(buf, space(buf, off + 1).end())
+            if off is None:
+                return _HAND_OFF, None
+            if pieces is None or field in field_pos:
+                # Let the regular parser warn about it
+                hand_off = True
+                continue
+            fields.append((field, _LazyValue(buf, encoding, pieces)))
+            field_pos[field] = factory.offset_to_lazy_pos(field_off)
+        end = space(buf, off + 1).end()
+
+        if self.__wanted_keys is not None and \
+           key.lower() not in self.__wanted_keys:
+            self.__skipped += 1
+            return None, end
+        if hand_off:
+            return _HAND_OFF, end
+        entry = CompactEntry(fields, typ, key,
+                             factory.offset_to_lazy_pos(start), field_pos)
+        if self.__wanted_keys is not None and 'crossref' in entry:
+            # Keep the cross-referenced entry, too
+            self.__wanted_keys.add(entry['crossref'].lower())
+        return entry, end
+
+    def _skim_field_value(self, buf, off):
+        """Scan the field value at buf[off] for parse_mmap.
+
+        Returns the pieces of the value for _LazyValue and the offset
+        following the value.  Macros are expanded right away, but the
+        pieces are None if one of them is unknown.  The offset is None
+        if the value is malformed.
+        """
+        space, pieces = BYTES_SPACE_RE.match, []
+        while True:
+            char = buf[off:off+1]
+            if char == b'{' or char == b'"':
+                end = self._skim_balanced_text(
+                    buf, off + 1, b'}' if char == b'{' else b'"')
+                if end is None:
+                    return None, None
+                if pieces is not None:
+                    pieces.append((off + 1, end))
+                off = end + 1
+            else:
+                m = (BYTES_NUMBER_RE if char.isdigit() else BYTES_ID_RE).match(buf, off)
+                if m is None:
+                    return None, None
+                piece, off = m.group().decode('ascii'), m.end()
+                if not char.isdigit():
+                    name, piece = piece.lower(), self.__macros.get(piece.lower())
+                    if self.__keep_source:
+                        self.__macro_deps.setdefault(name, piece)
+                if piece is None or pieces is None:
+                    pieces = None
+                else:
+                    pieces.append(_compress_space(piece))
+            off = space(buf, off).end()
+            if buf[off:off+1] != b'#':
+                return pieces, off
+            off = space(buf, off + 1).end()
+
+    @staticmethod
+    def _skim_balanced_text(buf, off, term):
+        """Return the offset of the term that ends the text at buf[off].
+
+        Returns None if the braces are not balanced.
+        """
+        search, level = BYTES_BALANCED_RES[term].search, 0
+        m = search(buf, off)
+        while m is not None:
+            char = m.group()
+            if level == 0 and char == term:
+                return m.start()
+            elif char == b'{':
+                level += 1
+            elif char == b'}':
+                level -= 1
+                if level < 0:
+                    return None
+            m = search(buf, m.end())
+        return None
+
+    def get_macros(self):
+        """Return the macro table.
+
+        This is a dictionary mapping lower-cased macro names to their
+        values, including the month macros and any @string commands
+        parsed so far.
+        """
+        return self.__macros
+
+    def get_sources(self):
+        """Return the text of the entries, if keep_source was True.
+
+        This is a dictionary mapping lower-cased keys like those of
+        get_entries to the text of each entry from its @ to its closing
+        delimiter, with trailing white space removed from its lines
+        (except for parse_mmap).  Entries whose key was renamed because
+        it was repeated are left out.
+        """
+        return self.__sources
+
     def get_entries(self):
         """Return the entry database.
 
@@ -133,7 +992,17 @@ class Parser:
         """
         return self.__entries
 
+    def get_skipped_count(self):
+        """Return the number of entries skipped because their keys
+        were not wanted (see the keys argument of Parser)."""
+        return self.__skipped
+
     def _fail(self, msg, off=None):
+        if self.__off >= len(self.__data):
+            if not self.__eof:
+                # Not an error yet, the rest may be in the next chunk
+                raise _NeedMoreData()
+            self.__hit_eof = True
         if off is None:
             off = self.__off
         self.__pos_factory.offset_to_pos(off).raise_error(msg)
@@ -161,9 +1030,8 @@ class Parser:
     def _try_tok(self, regexp, skip_space=True):
         """Scan regexp followed by white space.
 
-        Returns the matched text, or None if the match failed."""
-        if isinstance(regexp, str):
-            regexp = re.compile(regexp)
+        regexp must be a compiled pattern.  Returns the matched text,
+        or None if the match failed."""
         m = regexp.match(self.__data, self.__off)
         if m is None:
             return None
@@ -174,21 +1042,26 @@ class Parser:
 
     def _scan_balanced_text(self, term):
         """Scan brace-balanced text terminated with character term."""
-        start, level = self.__off, 0
-        while self.__off < len(self.__data):
-            char = self.__data[self.__off]
+        # Jump from one brace or terminator to the next
+        data, start, level = self.__data, self.__off, 0
+        search = BALANCED_RES[term].search
+        m = search(data, start)
+        while m is not None:
+            off = m.start()
+            char = data[off]
             if level == 0 and char == term:
-                text = self.__data[start:self.__off]
-                self.__off += 1
+                self.__off = off + 1
                 self._skip_space()
-                return text
+                return data[start:off]
             elif char == '{':
                 level += 1
             elif char == '}':
                 level -= 1
                 if level < 0:
+                    self.__off = off
                     self._fail('unexpected }')
-            self.__off += 1
+            m = search(data, off + 1)
+        self.__off = len(data)
         self._fail('unterminated string')
 
     def _skip_space(self):
@@ -216,9 +1089,9 @@ class Parser:
         # See get_bib_command_or_entry_and_process
 
         # Skip to the next database entry or command
-        self._tok('[^@]*')
-        pos = self.__pos_factory.offset_to_pos(self.__off)
-        if not self._try_tok('@'):
+        self._tok(NOISE_RE)
+        pos = self.__pos_factory.offset_to_lazy_pos(self.__off)
+        if not self._try_tok(AT_RE):
             return None
 
         # Scan command or entry type
@@ -230,37 +1103,42 @@ class Parser:
             # inter-entry noise.
             return None
 
-        left = self._tok('[{(]', 'expected { or ( after entry type')
-        right, right_re = (')', '\\)') if left == '(' else ('}', '}')
+        left = self._tok(LEFT_RE, 'expected { or ( after entry type')
+        right, right_re = (')' if left == '(' else '}'), RIGHT_RES[left]
 
         if typ == 'preamble':
-            # Parse the preamble, but ignore it
-            self._scan_field_value()
+            value = self._scan_field_value()
             self._tok(right_re, 'expected '+right)
-            return None
+            return Preamble(value, pos)
 
         if typ == 'string':
             name = self._scan_identifier().lower()
             if name in self.__macros:
                 self._warn('macro `{}\' redefined'.format(name))
-            self._tok('=', 'expected = after string name')
+            self._tok(EQUALS_RE, 'expected = after string name')
             value = self._scan_field_value()
             self._tok(right_re, 'expected '+right)
-            self.__macros[name] = value
-            return None
+            return String(name, value, pos)
 
         # Not a command, must be a database entry
 
         # Scan the entry's database key
-        if left == '(':
-            # The database key is anything up to a comma, white
-            # space, or end-of-line (yes, the key can be empty,
-            # and it can include a close paren)
-            key = self._tok('[^, \t\n]*')
-        else:
-            # The database key is anything up to comma, white
-            # space, right brace, or end-of-line
-            key = self._tok('[^, \t}\n]*')
+        # (yes, the key can be empty, and with parentheses it can
+        # include a close paren)
+        key = self._tok(KEY_RES[left])
+
+        if self.__wanted_keys is not None and \
+           key.lower() not in self.__wanted_keys:
+            self._skip_fields(right_re, right)
+            return _SKIPPED
+
+        if self.__lazy:
+            fields, macros = self._index_fields(right_re, right, pos)
+            entry = LazyEntry(self.__data[pos.offset:self.__off], macros,
+                              typ, key, pos)
+            if self.__wanted_keys is not None and 'crossref' in fields:
+                self.__wanted_keys.add(entry['crossref'].lower())
+            return entry
 
         # Scan entries (starting with comma or close after key)
         fields = []
@@ -268,14 +1146,14 @@ class Parser:
         while True:
             if self._try_tok(right_re):
                 break
-            self._tok(',', 'expected {} or ,'.format(right))
+            self._tok(COMMA_RE, 'expected {} or ,'.format(right))
             if self._try_tok(right_re):
                 break
 
             # Scan field name and value
             field_off = self.__off
             field = self._scan_identifier().lower()
-            self._tok('=', 'expected = after field name')
+            self._tok(EQUALS_RE, 'expected = after field name')
             value = self._scan_field_value()
 
             if field in field_pos:
@@ -283,53 +1161,256 @@ class Parser:
                 continue
 
             fields.append((field, value))
-            field_pos[field] = self.__pos_factory.offset_to_pos(field_off)
+            field_pos[field] = self.__pos_factory.offset_to_lazy_pos(field_off)
 
-        if key.lower() in self.__entries:
-            if self.__repeatKeySuffix is None:
-                self._fail('repeated entry')
+        if self.__wanted_keys is not None and 'crossref' in field_pos:
+            # Keep the cross-referenced entry, too
+            self.__wanted_keys.add(dict(fields)['crossref'].lower())
+        return self.__entry_class(fields, typ, key, pos, field_pos)
+
+    def _skip_fields(self, right_re, right):
+        """Scan the fields of an entry without building them."""
+        while True:
+            if self._try_tok(right_re):
+                break
+            self._tok(COMMA_RE, 'expected {} or ,'.format(right))
+            if self._try_tok(right_re):
+                break
+            self._scan_identifier()
+            self._tok(EQUALS_RE, 'expected = after field name')
+            self._skip_field_piece()
+            while self._try_tok(HASH_RE):
+                self._skip_field_piece()
+
+    def _index_fields(self, right_re, right, pos):
+        """Scan the fields of an entry for a LazyEntry.
+
+        This only checks the fields for the errors and warnings that
+        _scan_command_or_entry would report.  Returns the set of field
+        names and the values of the macros the fields refer to.
+        """
+        fields, macros = set(), {}
+        while True:
+            if self._try_tok(right_re):
+                break
+            m = INDEX_FIELD_RE.match(self.__data, self.__off)
+            if m is not None:
+                # The common case, in a single match
+                self.__off = m.end()
+                field = m.group('field').lower()
+                if m.group('macro') is not None:
+                    self._index_macro(m.group('macro'), m.start('macro'),
+                                      macros)
             else:
-                repeatKeys = self.__key2repeatKeys.setdefault(key, {key})
-                while True:
-                    key += self.__repeatKeySuffix
-                    if key not in repeatKeys:
-                        repeatKeys.add(key)
-                        break
-                    
-                    
-        self.__entries[key.lower()] = Entry(fields, typ, key, pos, field_pos)
+                self._tok(COMMA_RE, 'expected {} or ,'.format(right))
+                if self._try_tok(right_re):
+                    break
+                field = self._scan_identifier().lower()
+                self._tok(EQUALS_RE, 'expected = after field name')
+                self._index_field_piece(macros)
+                while self._try_tok(HASH_RE):
+                    self._index_field_piece(macros)
+            if field in fields:
+                pos.warn('repeated field `{}\''.format(field))
+            fields.add(field)
+        return fields, macros
+
+    def _index_field_piece(self, macros):
+        char = self.__data[self.__off:self.__off+1]
+        if char == '{' or char == '"':
+            self.__off += 1
+            self._scan_balanced_text('}' if char == '{' else '"')
+            return
+        if char.isdigit() and self._try_tok(NUMBER_RE) is not None:
+            return
+        opos = self.__off
+        piece = self._try_tok(ID_RE)
+        if piece is None:
+            self._fail('expected string, number, or macro name')
+        self._index_macro(piece, opos, macros)
+
+    def _index_macro(self, piece, off, macros):
+        if self.__keep_source:
+            self.__macro_deps.setdefault(piece.lower(),
+                                         self.__macros.get(piece.lower()))
+        if piece.lower() in self.__macros:
+            macros[piece.lower()] = self.__macros[piece.lower()]
+        else:
+            self._warn('unknown macro `{}\''.format(piece), off)
+
+    @classmethod
+    def _scan_lazy_entry(cls, text, macros, pos):
+        """Scan the text of a LazyEntry starting at pos into an entry.
+
+        Warnings are not repeated.
+        """
+        parser = cls(month_style=None)
+        parser.__macros = macros
+        log = None if pos.log_fp is None else _DeferredLog(pos.log_fp)
+        parser.__data, parser.__off, parser.__eof = text, 0, True
+        parser.__pos_factory = messages.PosFactory(
+            pos.fname, text, log, line=pos.line, col=pos.col)
+        if log is not None:
+            log.hold()
+        entry = parser._scan_command_or_entry()
+        parser.__pos_factory.release()
+        if log is not None:
+            log.discard()
+        return entry
+
+    def _skip_field_piece(self):
+        char = self.__data[self.__off:self.__off+1]
+        if char == '{' or char == '"':
+            self.__off += 1
+            self._scan_balanced_text('}' if char == '{' else '"')
+        elif self._try_tok(NUMBER_RE if char.isdigit() else ID_RE) is None:
+            self._fail('expected string, number, or macro name')
 
     def _scan_field_value(self):
         # See scan_and_store_the_field_value_and_eat_white
+        # Pieces come with compressed white space (see
+        # _scan_field_piece), so only a space on either side of a #
+        # can make a run
         value = self._scan_field_piece()
-        while self._try_tok('#'):
-            value += self._scan_field_piece()
-        # Compress spaces in the text.  Bibtex does this
-        # (painstakingly) as it goes, but the final effect is the same
-        # (see check_for_and_compress_bib_white_space).
-        value = re.sub('[ \t\n]+', ' ', value)
+        while self._try_tok(HASH_RE):
+            piece = self._scan_field_piece()
+            if piece[:1] == ' ' and value[-1:] == ' ':
+                piece = piece[1:]
+            value += piece
         # Strip leading and trailing space (literally just space, see
         # @<Store the field value string@>)
         return value.strip(' ')
 
     def _scan_field_piece(self):
-        # See scan_a_field_token_and_eat_white
-        piece = self._try_tok('[0-9]+')
-        if piece is not None:
-            return piece
-        if self._try_tok('{', skip_space=False):
-            return self._scan_balanced_text('}')
-        if self._try_tok('"', skip_space=False):
-            return self._scan_balanced_text('"')
+        # See scan_a_field_token_and_eat_white.  This dispatches on the
+        # first character of the piece.
+        #
+        # White space is compressed as pieces are scanned.  Bibtex does
+        # this (painstakingly) as it goes, but the final effect is the
+        # same (see check_for_and_compress_bib_white_space).
+        char = self.__data[self.__off:self.__off+1]
+        if char == '{' or char == '"':
+            self.__off += 1
+            return _compress_space(
+                self._scan_balanced_text('}' if char == '{' else '"'))
+        if char.isdigit():
+            piece = self._try_tok(NUMBER_RE)
+            if piece is not None:
+                return piece
         opos = self.__off
         piece = self._try_tok(ID_RE)
         if piece is not None:
+            if self.__incremental or self.__keep_source:
+                self.__macro_deps.setdefault(piece.lower(),
+                                             self.__macros.get(piece.lower()))
             if piece.lower() not in self.__macros:
                 self._warn('unknown macro `{}\''.format(piece), opos)
                 return ''
-            return self.__macros[piece.lower()]
+            return _compress_space(self.__macros[piece.lower()])
         self._fail('expected string, number, or macro name')
 
+def _compress_space(text):
+    """Replace every run of white space in text with a single space."""
+    if '\n' in text or '\t' in text or '  ' in text:
+        return SPACE_RUN_RE.sub(' ', text)
+    return text
+
+def _fill(text, width, initial_indent, subsequent_indent):
+    """Word wrap text at width columns and return it as one string.
+
+    This returns exactly what textwrap.fill does when expand_tabs,
+    replace_whitespace, break_long_words and break_on_hyphens are all
+    False, without all the generality of textwrap.TextWrapper: text
+    is only broken at runs of white space, which are dropped at the
+    ends of lines and at the beginnings of all lines but the first.
+    """
+    if width <= 0:
+        raise ValueError('invalid width %r (must be > 0)' % width)
+    if len(initial_indent) + len(text) <= width and text and \
+       not text[-1].isspace():
+        # The common case of a value that fits on the first line
+        return initial_indent + text
+
+    # Alternating words and runs of white space, and the offset in
+    # text at which each of them ends
+    chunks = _split_wrap_chunks(text)
+    ends = list(itertools.accumulate(map(len, chunks)))
+    lines, i, n = [], 0, len(chunks)
+    while i < n:
+        indent = subsequent_indent if lines else initial_indent
+        if lines and not chunks[i].strip():
+            i += 1
+            if i == n:
+                break
+        # Take as many chunks as fit
+        begin = ends[i - 1] if i else 0
+        start, i = i, bisect.bisect_right(ends, begin + width - len(indent), i)
+        if i == start:
+            # Don't break long words, but give them their own line
+            i += 1
+        end = i
+        if not chunks[end - 1].strip():
+            end -= 1
+        if end > start:
+            lines.append(indent + text[begin:ends[end - 1]])
+    return '\n'.join(lines)
+
+def _split_wrap_chunks(text):
+    """Split text into words and the runs of white space between them."""
+    if '  ' in text or '\n' in text or '\t' in text or '\r' in text or \
+       '\x0b' in text or '\x0c' in text:
+        return [chunk for chunk in WRAP_SPACE_RE.split(text) if chunk]
+    # Most field values only have single spaces, which str.split finds
+    # much faster than a regexp
+    words = text.split(' ')
+    chunks = [' '] * (2 * len(words) - 1)
+    chunks[::2] = words
+    if not chunks[-1]:
+        del chunks[-1]
+    if chunks and not chunks[0]:
+        del chunks[0]
+    return chunks
+
+def _translate_newlines(text):
+    """Translate newlines like a file opened in text mode does."""
+    if '\r' in text:
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+class _LazyValue:
+    """A field value found by Parser.parse_mmap, decoded on demand.
+
+    pieces lists the pieces of the value: (start, end) spans of buf for
+    text in braces or quotes, and strings for numbers and expanded
+    macros.
+    """
+
+    __slots__ = ('buf', 'encoding', 'pieces')
+
+    def __init__(self, buf, encoding, pieces):
+        self.buf, self.encoding, self.pieces = buf, encoding, pieces
+
+    def decode(self):
+        """Return the value as _scan_field_value would have."""
+        value = ''
+        for piece in self.pieces:
+            if not isinstance(piece, str):
+                piece = _compress_space(_translate_newlines(
+                    self.buf[piece[0]:piece[1]].decode(self.encoding)))
+            if piece[:1] == ' ' and value[-1:] == ' ':
+                piece = piece[1:]
+            value += piece
+        return value.strip(' ')
+
+class String(collections.namedtuple('String', 'name value pos')):
+    """An @string command, as yielded by Parser.iter_entries.
+
+    name is the lower-cased macro name and value its expanded value.
+    """
+
+class Preamble(collections.namedtuple('Preamble', 'value pos')):
+    """A @preamble command, as yielded by Parser.iter_entries."""
+
 class FieldError(KeyError):
     def __init__(self, field, entry=None):
         super().__init__(field)
@@ -364,6 +1445,9 @@ class Entry(collections.OrderedDict):
     def copy(self):
         return self.__class__(self, self.typ, self.key, self.pos, self.field_pos)
 
+    def __reduce__(self):
+        return (self.__class__, (list(self.items()),), self.__dict__)
+
     def __str__(self):
         return '`{}\' at {}'.format(self.key, self.pos)
 
@@ -375,6 +1459,8 @@ class Entry(collections.OrderedDict):
 
     def __eq__(self, o):
         """Two Entries are equal if they have the same fields, type, and key."""
+        if isinstance(o, (CompactEntry, CrossrefView)):
+            return NotImplemented
         return super().__eq__(o) and self.typ == o.typ and self.key == o.key
 
     def to_bib(self, *, month_to_macro=True, wrap_width=70, bibdesk_compatible=False):
@@ -412,13 +1498,9 @@ class Entry(collections.OrderedDict):
             elif wrap_width is None:
                 lines.append(start + '{' + v + '},')
             else:
-                lines.append(textwrap.fill(
-                    v, width=wrap_width,
-                    # Keep whitespace formatting as it is
-                    expand_tabs=False, replace_whitespace=False,
-                    # Don't break long things like URLs
-                    break_long_words=False, break_on_hyphens=False,
-                    initial_indent=start + '{', subsequent_indent='    ') + '},')
+                # Keep whitespace formatting as it is, and don't break
+                # long things like URLs
+                lines.append(_fill(v, wrap_width, start + '{', '    ') + '},')
         if bibdesk_compatible:
             last_line = lines[-1]
             lines[-1] = last_line[:-1] + '}'
@@ -427,23 +1509,15 @@ class Entry(collections.OrderedDict):
         return '\n'.join(lines)
 
     def resolve_crossref(self, entries):
-        """Return a new entry with crossref-ed fields incorporated.
+        """Return a view of this entry with crossref-ed fields incorporated.
 
         entries must be the database in which to find any crossref-ed
-        database entries.
+        database entries.  Nested crossrefs are followed, too (see
+        CrossrefView).  Raises InputError if the crossref is unknown.
         """
         if 'crossref' not in self:
             return self
-        nentry = self.copy()
-        source = entries[self['crossref'].lower()]
-        if 'crossref' in source:
-            self.field_pos['crossref'].warn('nested crossref')
-        for k, v in source.items():
-            if k not in nentry:
-                nentry[k] = v
-                nentry.field_pos[k] = source.field_pos[k]
-        del nentry['crossref']
-        return nentry
+        return CrossrefView(*_crossref_chain(self, entries))
 
     def date_key(self):
         """Return a sort key appropriate for sorting by date.
@@ -485,12 +1559,358 @@ class Entry(collections.OrderedDict):
         from .algo import parse_month
         return parse_month(self[field], pos=self.field_pos[field])
 
+class CompactEntry(collections.abc.MutableMapping):
+    """A memory-efficient alternative to Entry.
+
+    This has the same interface as Entry, but stores field names,
+    values and positions in parallel lists rather than in dictionaries
+    and has no instance dictionary.  field_pos is a view of the names
+    and positions; fields added after the entry was created have no
+    position.  Field names and entry types are interned, so they are
+    shared by all entries.  Looking up a field takes time linear in
+    the number of fields of the entry, which is small in practice.
+
+    Entries built by Parser.parse_mmap decode each field value when it
+    is first looked up.
+    """
+
+    __slots__ = ('__names', '__values', '__positions', 'typ', 'key', 'pos')
+
+    def __init__(self, fields, typ=None, key=None, pos=None, field_pos=None):
+        self.__names, self.__values, self.__positions = [], [], []
+        self.update(fields)
+        if typ is not None:
+            typ = sys.intern(typ)
+        self.typ, self.key, self.pos, self.field_pos = typ, key, pos, field_pos
+
+    @property
+    def field_pos(self):
+        return _FieldPositions(self.__names, self.__positions)
+
+    @field_pos.setter
+    def field_pos(self, field_pos):
+        if field_pos is None:
+            field_pos = {}
+        self.__positions[:] = [field_pos.get(field) for field in self.__names]
+
+    def copy(self):
+        return self.__class__(self, self.typ, self.key, self.pos, self.field_pos)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self.items()), self.typ, self.key,
+                                 self.pos, dict(self.field_pos)))
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, list(self.items()))
+
+    def __str__(self):
+        return '`{}\' at {}'.format(self.key, self.pos)
+
+    def __len__(self):
+        return len(self.__names)
+
+    def __iter__(self):
+        return iter(self.__names)
+
+    def __contains__(self, field):
+        return field in self.__names
+
+    def __getitem__(self, field):
+        try:
+            index = self.__names.index(field)
+        except ValueError:
+            raise FieldError(field, self) from None
+        value = self.__values[index]
+        if type(value) is _LazyValue:
+            # Decode on first use (see Parser.parse_mmap)
+            value = self.__values[index] = value.decode()
+        return value
+
+    def __setitem__(self, field, value):
+        try:
+            self.__values[self.__names.index(field)] = value
+        except ValueError:
+            self.__names.append(sys.intern(field))
+            self.__values.append(value)
+            self.__positions.append(None)
+
+    def __delitem__(self, field):
+        try:
+            index = self.__names.index(field)
+        except ValueError:
+            raise FieldError(field, self) from None
+        del self.__names[index], self.__values[index], self.__positions[index]
+
+    def __eq__(self, o):
+        """Two entries are equal if they have the same fields, type, and key."""
+        if not isinstance(o, _ENTRY_CLASSES):
+            return NotImplemented
+        return list(self.items()) == list(o.items()) and \
+            self.typ == o.typ and self.key == o.key
+
+    __hash__ = None
+
+    to_bib = Entry.to_bib
+    resolve_crossref = Entry.resolve_crossref
+    date_key = Entry.date_key
+    authors = Entry.authors
+    month_num = Entry.month_num
+
+class _FieldPositions(collections.abc.MutableMapping):
+    """The field_pos of a CompactEntry.
+
+    This is a view of the parallel lists of field names and positions
+    of the entry.  Fields without a position are left out.
+    """
+
+    __slots__ = ('__names', '__positions')
+
+    def __init__(self, names, positions):
+        self.__names, self.__positions = names, positions
+
+    def __index(self, field):
+        try:
+            index = self.__names.index(field)
+        except ValueError:
+            raise KeyError(field) from None
+        return index
+
+    def __getitem__(self, field):
+        pos = self.__positions[self.__index(field)]
+        if pos is None:
+            raise KeyError(field)
+        return pos
+
+    def __setitem__(self, field, pos):
+        # Only fields of the entry can have a position
+        self.__positions[self.__index(field)] = pos
+
+    def __delitem__(self, field):
+        index = self.__index(field)
+        if self.__positions[index] is None:
+            raise KeyError(field)
+        self.__positions[index] = None
+
+    def __iter__(self):
+        return (field for field, pos in zip(self.__names, self.__positions)
+                if pos is not None)
+
+    def __len__(self):
+        return len(self.__positions) - self.__positions.count(None)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class LazyEntry(CompactEntry):
+    """A CompactEntry whose fields are scanned when they are first used.
+
+    Parser(lazy=True) builds these from the type, key, and text of an
+    entry and the values of the macros it refers to.  Looking up the
+    type, key, or pos does not scan the fields, but anything else
+    (including field_pos) does.  Copies are CompactEntry objects.
+    """
+
+    __slots__ = ('__text', '__macros')
+
+    def __init__(self, text, macros, typ=None, key=None, pos=None):
+        self.__text, self.__macros = text, macros
+        super().__init__((), typ, key, pos)
+
+    def _materialize(self):
+        if self.__text is None:
+            return
+        entry = Parser._scan_lazy_entry(self.__text, self.__macros, self.pos)
+        self.__text = self.__macros = None
+        for field, value in entry.items():
+            super().__setitem__(field, value)
+        CompactEntry.field_pos.fset(self, entry.field_pos)
+
+    @property
+    def field_pos(self):
+        self._materialize()
+        return CompactEntry.field_pos.fget(self)
+
+    @field_pos.setter
+    def field_pos(self, field_pos):
+        CompactEntry.field_pos.fset(self, field_pos)
+
+    def copy(self):
+        return CompactEntry(self, self.typ, self.key, self.pos, self.field_pos)
+
+    def __reduce__(self):
+        if self.__text is None:
+            return (CompactEntry, (list(self.items()), self.typ, self.key,
+                                   self.pos, dict(self.field_pos)))
+        return (self.__class__, (self.__text, self.__macros, self.typ,
+                                 self.key, self.pos))
+
+    def __len__(self):
+        self._materialize()
+        return super().__len__()
+
+    def __iter__(self):
+        self._materialize()
+        return super().__iter__()
+
+    def __contains__(self, field):
+        self._materialize()
+        return super().__contains__(field)
+
+    def __getitem__(self, field):
+        self._materialize()
+        return super().__getitem__(field)
+
+    def __setitem__(self, field, value):
+        self._materialize()
+        super().__setitem__(field, value)
+
+    def __delitem__(self, field):
+        self._materialize()
+        super().__delitem__(field)
+
+class CrossrefView(collections.abc.Mapping):
+    """A read-only view of an entry with crossref-ed fields incorporated.
+
+    chain lists the entry followed by the entries it cross-references,
+    directly or through nested crossrefs.  Looking up a field goes
+    through chain and returns the value from the first entry that has
+    it, so nothing is copied and changes to the entries show through.
+    Fields are listed in the order of the entry, followed by the fields
+    each entry in chain adds.  The crossref field is hidden, unless
+    keep_crossref is True, in which case it is the crossref of the
+    last entry in chain, which was not followed.
+
+    typ, key, and pos are those of the entry, and field_pos is a view
+    of the field positions of chain.  Otherwise, this has the
+    interface of Entry, except that it cannot be modified.  Use copy
+    to get a modifiable Entry.
+    """
+
+    __slots__ = ('__chain', '__keep_crossref')
+
+    def __init__(self, chain, keep_crossref=False):
+        self.__chain, self.__keep_crossref = tuple(chain), keep_crossref
+
+    typ = property(lambda self: self.__chain[0].typ)
+    key = property(lambda self: self.__chain[0].key)
+    pos = property(lambda self: self.__chain[0].pos)
+
+    @property
+    def field_pos(self):
+        maps = [entry.field_pos for entry in self.__chain]
+        if self.__keep_crossref and len(maps) > 1:
+            maps.insert(0, {'crossref': maps[-1]['crossref']})
+        return collections.ChainMap(*maps)
+
+    def copy(self):
+        return Entry(self, self.typ, self.key, self.pos,
+                     {field: self.field_pos[field] for field in self})
+
+    def __reduce__(self):
+        return self.copy().__reduce__()
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, list(self.items()))
+
+    def __str__(self):
+        return '`{}\' at {}'.format(self.key, self.pos)
+
+    def __len__(self):
+        return sum(1 for field in self)
+
+    def __iter__(self):
+        seen = set() if self.__keep_crossref else {'crossref'}
+        for entry in self.__chain:
+            for field in entry:
+                if field not in seen:
+                    seen.add(field)
+                    yield field
+
+    def __contains__(self, field):
+        if field == 'crossref':
+            return self.__keep_crossref
+        return any(field in entry for entry in self.__chain)
+
+    def __getitem__(self, field):
+        if field == 'crossref':
+            if self.__keep_crossref:
+                return self.__chain[-1]['crossref']
+        else:
+            for entry in self.__chain:
+                if field in entry:
+                    return entry[field]
+        raise FieldError(field, self)
+
+    def __eq__(self, o):
+        """Two entries are equal if they have the same fields, type, and key."""
+        if not isinstance(o, _ENTRY_CLASSES):
+            return NotImplemented
+        return list(self.items()) == list(o.items()) and \
+            self.typ == o.typ and self.key == o.key
+
+    __hash__ = None
+
+    to_bib = Entry.to_bib
+    date_key = Entry.date_key
+    authors = Entry.authors
+    month_num = Entry.month_num
+
+    def resolve_crossref(self, entries):
+        return self
+
+_ENTRY_CLASSES = (Entry, CompactEntry, CrossrefView)
+
+def _crossref_chain(entry, db, key_idx=None, entry_idx=None, counts=None,
+                    min_crossrefs=None):
+    """Follow the crossrefs of entry in db for a CrossrefView.
+
+    Returns the chain of entries, starting with entry, and whether the
+    last one keeps its crossref field because the entry it refers to
+    is cross-referenced by min_crossrefs or more entries (according to
+    counts).  If key_idx is not None, it maps keys to indexes in db,
+    entry_idx is the index of entry, and crossrefs must refer to later
+    entries.
+
+    Raises InputError if the crossref of entry is unknown or refers to
+    an earlier entry.  Nested crossrefs with these problems just end
+    the chain, since they are reported for the entries that have them.
+    A crossref that would lead back into the chain ends it with a
+    warning.
+    """
+    chain, idx = [entry], entry_idx
+    while True:
+        crossref = chain[-1].get('crossref')
+        if crossref is None:
+            return chain, False
+        target = crossref.lower()
+        parent = db.get(target)
+        if parent is None or (idx is not None and key_idx[target] < idx):
+            if len(chain) > 1:
+                return chain, False
+            elif parent is None:
+                entry.field_pos['crossref'].raise_error(
+                    'unknown crossref `{}\''.format(crossref))
+            else:
+                entry.field_pos['crossref'].raise_error(
+                    'crossref `{}\' must come after entry'.format(crossref))
+        if counts and counts[target] >= min_crossrefs:
+            return chain, True
+        if any(parent is link for link in chain):
+            chain[-1].field_pos['crossref'].warn(
+                'circular crossref `{}\''.format(crossref))
+            return chain, False
+        chain.append(parent)
+        if idx is not None:
+            idx = key_idx[target]
+
 def resolve_crossrefs(db, min_crossrefs=None):
     """Resolve cross-referenced entries in db.
 
     This returns a new database containing the same entries in the
     same order as db, but any entries that crossref another entry are
-    expanded with the fields for the cross-referenced entry.
+    replaced with a CrossrefView that adds the fields of the
+    cross-referenced entry (and the entries it cross-references in
+    turn).  Nothing is copied.
 
     If min_crossrefs is not None, then any entry that is
     cross-referenced by min_crossrefs or more other entries will *not*
@@ -512,21 +1932,15 @@ def resolve_crossrefs(db, min_crossrefs=None):
     recoverer = messages.InputErrorRecoverer()
     ndb = collections.OrderedDict()
     for entry_idx, (key, entry) in enumerate(db.items()):
-        crossref = entry.get('crossref')
-        if crossref is None:
+        if 'crossref' not in entry:
             ndb[key] = entry
         else:
             with recoverer:
-                crossref_idx = key_idx.get(crossref.lower())
-                if crossref_idx is None:
-                    entry.field_pos['crossref'].raise_error(
-                        'unknown crossref `{}\''.format(crossref))
-                elif crossref_idx < entry_idx:
-                    entry.field_pos['crossref'].raise_error(
-                        'crossref `{}\' must come after entry'.format(crossref))
-                elif counts and counts[crossref.lower()] >= min_crossrefs:
+                chain, keep_crossref = _crossref_chain(
+                    entry, db, key_idx, entry_idx, counts, min_crossrefs)
+                if len(chain) == 1 and keep_crossref:
                     ndb[key] = entry
                 else:
-                    ndb[key] = entry.resolve_crossref(db)
+                    ndb[key] = CrossrefView(chain, keep_crossref)
     recoverer.reraise()
     return ndb
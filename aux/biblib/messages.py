@@ -1,4 +1,8 @@
+import array
+import bisect
 import collections
+import itertools
+import sys
 import threading
 import warnings
 
@@ -28,30 +32,152 @@ class Pos(collections.namedtuple('Pos', 'fname line col log_fp')):
 
 Pos.unknown = Pos('<unknown>', 1, 0, None)
 
+class LazyPos:
+    """A position that is resolved to a Pos only when it is used.
+
+    Until then, this stores only the PosFactory and the character
+    offset.  Attribute access, str, equality, iteration and pickling
+    all go through the resolved Pos, so a LazyPos can be used
+    wherever a Pos is expected.  Note that an unresolved LazyPos keeps
+    its factory alive (see PosFactory.release).
+    """
+
+    __slots__ = ('__factory', 'offset', '__pos')
+
+    def __init__(self, factory, offset):
+        self.__factory, self.offset, self.__pos = factory, offset, None
+
+    def resolve(self):
+        """Return the Pos this refers to."""
+        if self.__pos is None:
+            self.__pos = self.__factory.offset_to_pos(self.offset)
+            self.__factory = None
+        return self.__pos
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __str__(self):
+        return str(self.resolve())
+
+    def __repr__(self):
+        return repr(self.resolve())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyPos):
+            other = other.resolve()
+        return self.resolve() == other
+
+    def __hash__(self):
+        return hash(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __getitem__(self, index):
+        return self.resolve()[index]
+
+    def __reduce__(self):
+        return (Pos, tuple(self.resolve()))
+
+class StderrLog:
+    """A log file that writes to whatever sys.stderr currently is.
+
+    Unlike sys.stderr itself, this can be pickled along with the Pos
+    instances that refer to it.
+    """
+
+    def write(self, msg):
+        sys.stderr.write(msg)
+
 class PosFactory:
-    """A factory that translates character offsets to Pos instances."""
+    """A factory that translates character offsets to Pos instances.
+
+    line and col give the position of the first character of string,
+    which need not be the beginning of the file.
+
+    The offsets at which lines start are indexed on first use, after
+    which every offset is resolved by binary search, regardless of the
+    order in which offsets are requested.
 
-    def __init__(self, fname, string, log_fp=None):
+    Unresolved LazyPos instances keep their factory alive, so a parser
+    calls release once it is done with the string.
+    """
+
+    def __init__(self, fname, string, log_fp=None, line=1, col=0):
         self.__fname = fname
         self.__string = string
         self.__log_fp = log_fp
-        self.__cache = (0, 1, 0)
+        self.__line, self.__col = line, col
+        self.__line_starts = None
+
+    def release(self):
+        """Drop the string, keeping only the index of line starts.
+
+        Offsets can still be resolved afterwards.  The index takes a
+        few bytes per line, much less than the string itself.
+        """
+        if self.__line_starts is None:
+            self.__index()
+        self.__string = None
+
+    def __index(self):
+        starts = itertools.accumulate(
+            (len(l) + 1 for l in self.__string.split('\n')[:-1]), initial=0)
+        typecode = 'I' if len(self.__string) < 1 << 8 * array.array('I').itemsize else 'Q'
+        self.__line_starts = array.array(typecode, starts)
 
     def offset_to_pos(self, offset):
-        last_off, last_line, last_col = self.__cache
-        if last_off < offset:
-            last_off, last_line, last_col = 0, 1, 0
-
-        line = self.__string.count('\n', last_off, offset) + last_line
-        lastnl = self.__string.rfind('\n', last_off, offset)
-        if lastnl == -1:
-            col = last_col + (offset - last_off)
-        else:
-            col = offset - lastnl - 1
-        self.__cache = (offset, line, col)
+        if self.__line_starts is None:
+            self.__index()
+
+        index = bisect.bisect_right(self.__line_starts, offset) - 1
+        col = offset - self.__line_starts[index]
+        if index == 0:
+            col += self.__col
+        return Pos(self.__fname, self.__line + index, col, self.__log_fp)
+
+    def offset_to_lazy_pos(self, offset):
+        """Return a LazyPos for offset that is resolved on first use."""
+        return LazyPos(self, offset)
+
+class BufferPosFactory:
+    """A factory that translates byte offsets in an encoded buffer to Pos
+    instances.
+
+    buf is a bytes-like object such as an mmap holding text in an
+    ASCII-compatible encoding.  Lines are counted from the nearest
+    offset resolved before, so no index of the whole buffer is ever
+    built; columns are counted in characters, like those of
+    PosFactory.
+    """
+
+    def __init__(self, fname, buf, encoding='utf-8', log_fp=None):
+        self.__fname = fname
+        self.__buf = buf
+        self.__encoding = encoding
+        self.__log_fp = log_fp
+        # Sorted (offset, line) pairs of offsets resolved so far
+        self.__known = [(0, 1)]
 
+    def offset_to_pos(self, offset):
+        buf = self.__buf
+        index = bisect.bisect_right(self.__known, (offset, float('inf'))) - 1
+        start, line = self.__known[index]
+        if start != offset:
+            line += bytes(buf[start:offset]).count(b'\n')
+            self.__known.insert(index + 1, (offset, line))
+        line_start = buf.rfind(b'\n', 0, offset) + 1
+        col = len(bytes(buf[line_start:offset]).decode(self.__encoding, 'replace'))
         return Pos(self.__fname, line, col, self.__log_fp)
 
+    def offset_to_lazy_pos(self, offset):
+        """Return a LazyPos for offset that is resolved on first use."""
+        return LazyPos(self, offset)
+
 class InputError(ValueError):
     """One or more errors with associated Pos instances.
 
@@ -1,6 +1,8 @@
 import unittest
 import collections
 import io
+import os
+import tempfile
 from .bib import *
 from .algo import *
 from .messages import *
@@ -41,6 +43,11 @@ class BibParserTest(unittest.TestCase):
             '@misc{x, title={  a\t  b\n  c  }}',
             [ent('misc', 'x', od('title', 'a b c'))])
 
+    def test_compress_concat(self):
+        self.__test_parse(
+            '@misc{x, title={a\t} # { \n b } # " " # {c}}',
+            [ent('misc', 'x', od('title', 'a b c'))])
+
     def test_funny_keys(self):
         self.__test_parse(
             '@misc{@"#%\'()=, title="a"}',
@@ -66,6 +73,234 @@ class BibParserTest(unittest.TestCase):
             '@comment{abc@misc{x}',
             [ent('misc', 'x', od())])
 
+class IterEntriesTest(unittest.TestCase):
+    TEXT = ('@string{foo = {a}}\n@preamble{"p"}\n'
+            '@misc{x, title = foo # "b"}\n@misc{X, title={a{b}c}}\n'
+            '@comment{@misc{y, note={' + 'long '*20 + '}}')
+
+    def __items(self, chunk_size):
+        parser = Parser(repeatKeySuffix='_R')
+        return list(parser.iter_entries(io.StringIO(self.TEXT),
+                                        chunk_size=chunk_size))
+
+    def test_events(self):
+        items = self.__items(1 << 20)
+        self.assertEqual([type(item) for item in items],
+                         [String, Preamble, Entry, Entry, Entry])
+        self.assertEqual(items[0][:2], ('foo', 'a'))
+        self.assertEqual(items[1].value, 'p')
+        self.assertEqual([item.key for item in items[2:]], ['x', 'X_R', 'y'])
+
+    def test_chunked(self):
+        want = self.__items(1 << 20)
+        for chunk_size in range(1, 20):
+            got = self.__items(chunk_size)
+            self.assertEqual(got[2:], want[2:])
+            self.assertEqual([str(item.pos) for item in got],
+                             [str(item.pos) for item in want])
+
+    def __errors(self, text, **kwargs):
+        try:
+            list(Parser().iter_entries(io.StringIO(text), 'x.bib', **kwargs))
+        except InputError as e:
+            return [(str(pos), msg) for pos, msg in e.args[0][0]]
+        return []
+
+    def test_unterminated(self):
+        text = '@misc{x, title={a\n' + '@misc{y, title={b}}\n' * 50
+        self.assertEqual(self.__errors(text, chunk_size=7),
+                         self.__errors(text))
+        self.assertEqual(self.__errors(text),
+                         [('x.bib:52:0', 'unterminated string')])
+
+    def test_max_item_size(self):
+        from . import bib
+        text = '@misc{x, title={a\n' + '@misc{y, title={b}}\n' * 50
+        old, bib.MAX_ITEM_SIZE = bib.MAX_ITEM_SIZE, 100
+        try:
+            keys = []
+            with self.assertRaises(InputError) as cm:
+                for item in Parser(repeatKeySuffix='_R').iter_entries(
+                        io.StringIO(text), 'x.bib', chunk_size=7):
+                    keys.append(item.key)
+        finally:
+            bib.MAX_ITEM_SIZE = old
+        # Scanning resumes at the next @
+        self.assertEqual([(str(pos), msg) for pos, msg in cm.exception.args[0][0]],
+                         [('x.bib:1:0', 'command or entry too long')])
+        self.assertEqual(len(keys), 50)
+
+class ParseParallelTest(unittest.TestCase):
+    def test_same_as_parse(self):
+        text = ''.join('@string{m%d = {M%d}}\n@misc{k%d, title={T %d}, note=m%d}\n'
+                       % (i // 7, i, i % 50, i, i // 7 - 1) for i in range(200))
+        serial = Parser(repeatKeySuffix='_R').parse(text, log_fp=io.StringIO())
+        parallel = Parser(repeatKeySuffix='_R').parse_parallel(
+            text, log_fp=io.StringIO(), processes=2)
+        self.assertEqual(list(serial.get_entries().items()),
+                         list(parallel.get_entries().items()))
+        self.assertEqual(serial.get_repeated_key_dict(),
+                         parallel.get_repeated_key_dict())
+
+    def test_log_after_pickle(self):
+        import pickle
+        from . import bib
+        text = ''.join('@misc{k%d, author={A, B,}}\n' % i for i in range(50))
+        parser = Parser().parse_parallel(text, log_fp=io.StringIO(),
+                                         processes=2)
+        self.assertEqual(bib._shard_logs, {})
+        # As if loaded from a cache in a later run
+        entry = pickle.loads(pickle.dumps(parser.get_entries()['k49']))
+        entry.authors()
+        self.assertIn('warning: trailing comma',
+                      entry.field_pos['author'].log_fp.getvalue())
+
+class PosFactoryTest(unittest.TestCase):
+    def test_lazy_pos(self):
+        factory = PosFactory('f', 'ab\ncd\n\nef', line=3, col=4)
+        for off in (8, 0, 4, 7, 1):
+            lazy = factory.offset_to_lazy_pos(off)
+            self.assertEqual(lazy, factory.offset_to_pos(off))
+            self.assertEqual(str(lazy), str(factory.offset_to_pos(off)))
+        self.assertEqual(factory.offset_to_pos(1), Pos('f', 3, 5, None))
+        self.assertEqual(factory.offset_to_pos(8), Pos('f', 6, 1, None))
+
+    def test_release(self):
+        factory = PosFactory('f', 'ab\ncd\n\nef', line=3, col=4)
+        lazy = factory.offset_to_lazy_pos(8)
+        factory.release()
+        self.assertEqual(lazy, Pos('f', 6, 1, None))
+        self.assertEqual(factory.offset_to_pos(1), Pos('f', 3, 5, None))
+
+class IncrementalParseTest(unittest.TestCase):
+    text = '@string{j = {J}}\n@misc{a, title={A}, journal=j}\n@misc{b, title={B}}\n'
+
+    def test_reuse(self):
+        old = Parser(incremental=True).parse(self.text)
+        b = old.get_entries()['b']
+        new = Parser(incremental=True).parse(
+            '\n' + self.text.replace('{A}', '{A2}'), previous=old)
+        self.assertIs(new.get_entries()['b'], b)
+        self.assertEqual(b.pos.line, 4)
+        self.assertEqual(new.get_entries()['a']['title'], 'A2')
+
+    def test_macro_changed(self):
+        old = Parser(incremental=True).parse(self.text)
+        new = Parser(incremental=True).parse(
+            self.text.replace('{J}', '{K}'), previous=old)
+        self.assertEqual(new.get_entries()['a']['journal'], 'K')
+
+class KeyFilterTest(unittest.TestCase):
+    def test_keys(self):
+        text = ('@misc{a, title={A}, crossref={B}}\n@misc{c, title={{C}} # "x{y}z" # 2}\n'
+                '@string{s = {S}}\n@misc{b, title=s}\n@misc{d, title=s}')
+        entries = Parser(keys=['A']).parse(text).get_entries()
+        self.assertEqual(list(entries), ['a', 'b'])
+        self.assertEqual(entries['b']['title'], 'S')
+
+    def test_skipped_count(self):
+        text = ''.join('@misc{k%d, title={T}}\n' % i for i in range(5))
+        for parse in (lambda p: p.parse(text), lambda p: p.parse_parallel(text, processes=2)):
+            parser = parse(Parser(keys=['k1', 'k3']))
+            self.assertEqual(list(parser.get_entries()), ['k1', 'k3'])
+            self.assertEqual(parser.get_skipped_count(), 3)
+        self.assertEqual(Parser().parse(text).get_skipped_count(), 0)
+
+class CompactEntryTest(unittest.TestCase):
+    text = '@misc{x, title={T}, year=2000, month=feb}\n@book{y, title={U}}'
+
+    def test_same_as_entry(self):
+        entries = Parser().parse(self.text).get_entries()
+        compact = Parser(entry_class=CompactEntry).parse(self.text).get_entries()
+        self.assertEqual(list(entries.values()), list(compact.values()))
+        self.assertEqual(compact['x'].to_bib(), entries['x'].to_bib())
+        self.assertEqual(compact['x'].date_key(), (2000, 2))
+
+    def test_mapping(self):
+        entry = CompactEntry([('title', 'T'), ('year', '2000')],
+                             ''.join(['mi', 'sc']), 'x')
+        entry['note'] = 'N'
+        entry['title'] = 'T2'
+        del entry['year']
+        self.assertEqual(list(entry.items()), [('title', 'T2'), ('note', 'N')])
+        self.assertRaises(FieldError, lambda: entry['year'])
+        self.assertIs(entry.typ, 'misc')
+
+    def test_field_pos(self):
+        entries = Parser().parse(self.text).get_entries()
+        entry = Parser(entry_class=CompactEntry).parse(self.text).get_entries()['x']
+        self.assertEqual(dict(entry.field_pos), entries['x'].field_pos)
+        entry['note'] = 'N'
+        del entry['title']
+        self.assertEqual(list(entry.field_pos), ['year', 'month'])
+        self.assertRaises(KeyError, lambda: entry.field_pos['note'])
+        self.assertFalse(hasattr(entry, '__dict__'))
+
+class ParseMmapTest(unittest.TestCase):
+    text = ('@string{j = "Jour"}\r\n'
+            '@article{x, title = {A  \u00dcber\r\n  title}, journal = j # { 2},\r\n'
+            '  year = 2000}\r\n'
+            '@misc{y, note = nope}\n@comment{z}\n@misc{w, title={Lost}\n')
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix='.bib')
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as fp:
+            fp.write(self.text)
+
+    def tearDown(self):
+        os.unlink(self.fname)
+
+    def test_same_as_parse(self):
+        with open(self.fname, encoding='utf-8') as fp:
+            log = io.StringIO()
+            self.assertRaises(InputError, Parser().parse, fp, log_fp=log)
+        mlog = io.StringIO()
+        parser = Parser()
+        self.assertRaises(InputError, parser.parse_mmap, self.fname, log_fp=mlog)
+        self.assertEqual(mlog.getvalue(), log.getvalue())
+        entries = parser.get_entries()
+        self.assertEqual(list(entries), ['x', 'y'])
+        self.assertEqual(dict(entries['x']), {'title': 'A \u00dcber title',
+                                              'journal': 'Jour 2', 'year': '2000'})
+        self.assertEqual(str(entries['x'].field_pos['year']),
+                         '{}:4:2'.format(self.fname))
+
+class KeepSourceTest(unittest.TestCase):
+    text = ('@string{j = "Jour"}\n@misc{x, title={T}, \n  month=jan}  \n\n'
+            '@misc{y, journal=j}\n@misc{X, title={U}}\n')
+    sources = {'x': '@misc{x, title={T},\n  month=jan}'}
+
+    def test_parse(self):
+        for lazy in (False, True):
+            parser = Parser(keep_source=True, lazy=lazy, repeatKeySuffix='_')
+            parser.parse(self.text)
+            self.assertEqual(parser.get_sources(), self.sources)
+
+    def test_parse_parallel(self):
+        parser = Parser(keep_source=True, repeatKeySuffix='_')
+        parser.parse_parallel(self.text * 20, processes=2)
+        self.assertEqual(parser.get_sources(), self.sources)
+
+class LazyEntryTest(unittest.TestCase):
+    text = '@string{j = "Jour"}\n@misc{x, title={T}, journal=j, title={U}}'
+
+    def test_same_as_entry(self):
+        log = io.StringIO()
+        entries = Parser().parse(self.text, log_fp=log).get_entries()
+        lazy_log = io.StringIO()
+        parser = Parser(lazy=True)
+        parser.parse(self.text, log_fp=lazy_log)
+        parser.string('j', 'Changed')
+        lazy = parser.get_entries()['x']
+        self.assertIsInstance(lazy, LazyEntry)
+        self.assertEqual(lazy_log.getvalue(), log.getvalue())
+        self.assertEqual((lazy.typ, lazy.key), ('misc', 'x'))
+        self.assertEqual(lazy, entries['x'])
+        self.assertEqual({f: str(pos) for f, pos in lazy.field_pos.items()},
+                         {f: str(pos) for f, pos in entries['x'].field_pos.items()})
+        self.assertEqual(lazy_log.getvalue(), log.getvalue())
+        self.assertIs(type(lazy.copy()), CompactEntry)
+
 class EntryTest(unittest.TestCase):
     def test_to_bib(self):
         entry = Entry([('author', 'An Author'),
@@ -92,6 +327,22 @@ class EntryTest(unittest.TestCase):
   year         = 2013,
 }''')
 
+    def test_fill(self):
+        from .bib import _fill
+        import textwrap
+        for text in ['', '  ', 'word', ' lead and trail ', 'a  b\tc\nd',
+                     'http://example.com/' + 'x'*80 + ' and more',
+                     'x\u00a0 y ' * 20]:
+            for width in (1, 10, 25, 70):
+                self.assertEqual(
+                    _fill(text, width, '  field = {', '    '),
+                    textwrap.fill(text, width=width, expand_tabs=False,
+                                  replace_whitespace=False,
+                                  break_long_words=False,
+                                  break_on_hyphens=False,
+                                  initial_indent='  field = {',
+                                  subsequent_indent='    '))
+
     def test_month_num(self):
         def test(string, expect):
             entry = Entry([('month', string)], field_pos={'month': Pos.unknown})
@@ -163,6 +414,36 @@ class CrossRefTest(unittest.TestCase):
         resolve_crossrefs(self.parser.get_entries())
         self.assertIn('<ent3>:1:', log.getvalue())
 
+    def test_nested(self):
+        self.parser.parse("""\
+        @misc{ent3, title={Title 3}, crossref={ent4}}
+        @misc{ent4, booktitle={Book title 4}, crossref={ent5}, year=2000}
+        @misc{ent5, crossref={ent5}, note={Note 5}}""")
+        log = io.StringIO()
+        entries = self.parser.get_entries()
+        entries['ent5'].field_pos['crossref'] = Pos('<ent5>', 1, 0, log)
+        db = resolve_crossrefs(entries)
+        self.assertEqual(
+            ent('misc', 'ent3', [('title', 'Title 3'),
+                                 ('booktitle', 'Book title 4'),
+                                 ('year', '2000'), ('note', 'Note 5')]),
+            db['ent3'])
+        self.assertIn('<ent5>:1:0: warning: circular crossref', log.getvalue())
+        self.assertEqual(db['ent3'].field_pos['year'],
+                         entries['ent4'].field_pos['year'])
+        self.assertNotIn('booktitle', entries['ent3'].field_pos)
+
+        # Views follow changes to the entries
+        entries['ent5']['note'] = 'Changed'
+        self.assertEqual(db['ent3']['note'], 'Changed')
+
+        db = resolve_crossrefs(entries, min_crossrefs=2)
+        self.assertEqual(
+            ent('misc', 'ent3', [('title', 'Title 3'), ('crossref', 'ent5'),
+                                 ('booktitle', 'Book title 4'),
+                                 ('year', '2000')]),
+            db['ent3'])
+
     def test_bad_order(self):
         self.parser.parse("""\
         @misc{ent3, title={Title 3}, crossref={ent2}}""")
@@ -176,7 +457,8 @@ class NameParserTest(unittest.TestCase):
         for check, expect in [('abc', 'a'), ('ABC', 'A'), (' abc', 'a'),
                               ('\\abc', 'a'), ('{a} bc', 'b'),
                               ('{\\`a}bc', 'a'), ('{\\aa}bc', 'å'),
-                              ('{\\a}bc', 'a')]:
+                              ('{\\a}bc', 'a'), ('{{a}b} c', 'c'),
+                              ('-{\\ss}', 'ß'), ('{12}', '')]:
             self.assertEqual(p._first_char(check), expect)
 
     def test_and(self):
@@ -194,6 +476,18 @@ class NameParserTest(unittest.TestCase):
                          [Name('A B { and } C', '', 'D', '')])
         self.assertEqual(p('A B {\\ and } C D'),
                          [Name('A B', '{\\ and }', 'C D', '')])
+        self.assertEqual(p(' and '.join(['{A} {and} B, C'] * 600)),
+                         [Name('C', '', '{A} {and} B', '')] * 600)
+
+    def test_cache(self):
+        for _ in range(2):
+            log = io.StringIO()
+            names = parse_names('A B, and C D', Pos('f', 1, 0, log))
+            self.assertEqual(names, [Name('A', '', 'B', ''), Name('C', '', 'D', '')])
+            self.assertEqual(log.getvalue(),
+                             "f:1:0: warning: trailing comma after name `A B'\n")
+            # Changing the result must not change the cached names
+            names.append(None)
 
     def __test_names(self, *tests):
         for test in tests:
@@ -322,6 +616,8 @@ class TeXToUnicodeTest(unittest.TestCase):
     def test_accents(self):
         self.assertEqual(tex_to_unicode(r'{\`a}\^{e}'), 'àê')
         self.assertEqual(tex_to_unicode(r'\`i\`\i'), 'ìì')
+        self.assertEqual(tex_to_unicode(r'M{\"u}ller, \c{C}a\u{g}r{\i} ' * 500),
+                         'Müller, Çağrı ' * 500)
 
     def test_ligatures(self):
         self.assertEqual(tex_to_unicode(r'a--b---c-{-}d'), 'a\u2013b\u2014c--d')
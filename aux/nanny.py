@@ -4,15 +4,30 @@ Collection of functions used by various tools of the BibTexNanny toolkit.
 
 import sys
 import os
+import io
 import re
+import pickle
+import hashlib
+import stat
+import tempfile
+import contextlib
+import locale
+import itertools
+import concurrent.futures
 import configparser
 from collections import OrderedDict, namedtuple, Counter
+from collections.abc import Mapping
 from abc import ABC, abstractmethod
 
 from aux import biblib
 
 __author__ = 'Marc Schulder'
 
+REPEAT_KEY_SUFFIX = '_REPEATKEY'
+CACHE_VERSION = 1
+WRITE_BUFFER_SIZE = 1 << 16  # Bytes buffered by saveBibTex before writing to disk
+SAVE_BATCH_SIZE = 1000  # Entries formatted at a time by each worker process of saveBibTex
+
 FIELD_ADDRESS = 'address'
 FIELD_AUTHOR = 'author'
 FIELD_EDITOR = 'editor'
@@ -412,48 +427,379 @@ class Location:
         return ', '.join(elems)
 
 
-def loadBibTex(filename, loadPreamble=False):
-    if not (os.path.exists(filename) and os.path.isfile(filename)):
-        raise FileNotFoundError(filename)
+def loadBibTex(filename, loadPreamble=False, processes=None, cacheDir=None, keyWhitelist=None, memoryMap=False,
+               lazy=False, resolveCrossrefs=False, keepSources=False, countEntries=False):
+    """
+    Load all entries of a BibTeX file into a dictionary mapping lower-cased keys to entries.
+    filename may also be a list of files, which are loaded as one database: @string macros defined in a file can be
+    used by the files after it, and entries whose key was already used by an earlier entry (in any of the files)
+    get REPEAT_KEY_SUFFIX appended to their key (see findDuplicateKeys). The files are streamed one after the other.
+    Use getEntryFilename to find out which file an entry came from.
+    :param filename: Name of the file or list of file names
+    :param loadPreamble: If True, also return the text preceding the first entry (of every file)
+    :param processes: If greater than 1, parse the files with this many worker processes
+    :param cacheDir: If not None, reuse the parse results stored in this directory as long as the files are unchanged
+    :param keyWhitelist: If not None, only load the entries with these keys and the entries they cross-reference;
+                         all other entries are skipped by the parser. Like BibTeX, the parser only finds
+                         cross-referenced entries that follow the entries citing them. Ignored if cacheDir is given, as
+                         the cache always holds complete files.
+    :param memoryMap: If True, memory-map the files and only decode the field values that are actually used
+                      (see biblib.bib.Parser.parse_mmap). Ignored if cacheDir or processes is given.
+    :param lazy: If True, only scan the type and key of every entry up front and parse its fields when they are first
+                 used (see biblib.bib.LazyEntry). Ignored if cacheDir is given.
+    :param resolveCrossrefs: If True, entries with a crossref field are replaced by read-only views that also contain
+                             the fields of the cross-referenced entries (see biblib.bib.resolve_crossrefs)
+    :param keepSources: If True, also return a dictionary mapping lower-cased keys to the original text of the entries
+                        (see biblib.bib.Parser.get_sources), for saveBibTex
+    :param countEntries: If True, also return the number of entries in the files, including the skipped ones
+    :return:
+    """
+    filenames = [filename] if isinstance(filename, str) else list(filename)
+    for name in filenames:
+        if not (os.path.exists(name) and os.path.isfile(name)):
+            raise FileNotFoundError(name)
 
-    preamble = ''
+    # Parse BibTex entries
+    if cacheDir is not None:
+        if keepSources:
+            entries, preamble, key2source = loadCachedBibTex(filenames, cacheDir, processes, keepSources=True)
+        else:
+            entries, preamble = loadCachedBibTex(filenames, cacheDir, processes)
+            key2source = {}
+        entryCount = len(entries)
+    else:
+        preamble = ''
+        if loadPreamble:
+            preamble = ''.join(readPreamble(name) for name in filenames)
+        entries, parser = _parseBibTexFileNames(filenames, processes, keyWhitelist, memoryMap, lazy, keepSources)
+        key2source = parser.get_sources()
+        entryCount = len(entries) + parser.get_skipped_count()
+
+    # Resolve cross-references
+    if resolveCrossrefs:
+        entries = biblib.bib.resolve_crossrefs(entries)
+
+    result = [entries]
     if loadPreamble:
-        # Read preamble
-        preamble_lines = []
+        result.append(preamble)
+    if keepSources:
+        result.append(key2source)
+    if countEntries:
+        result.append(entryCount)
+    if len(result) == 1:
+        return entries
+    else:
+        return tuple(result)
+
+
+def _parseBibTexFileNames(filenames, processes, keyWhitelist, memoryMap=False, lazy=False, keepSources=False):
+    if memoryMap and not (processes is not None and processes > 1):
+        return mapBibTexFiles(filenames, keyWhitelist, keepSources)
+    return parseBibTexFiles(_openBibTexFiles(filenames), processes, keyWhitelist, lazy, keepSources)
+
+
+def _openBibTexFiles(filenames):
+    """
+    Open files one at a time while they are parsed, so that they can be streamed like a single file.
+    :param filenames:
+    :return: Iterator over (file object, filename) pairs for parseBibTexFiles
+    """
+    for filename in filenames:
         with open(filename) as f:
-            for line in f:
-                if line.strip().startswith('@') and not line.strip().startswith('@comment{'):
-                    break
-                else:
-                    preamble_lines.append(line)
-        preamble = ''.join(preamble_lines)
+            yield f, filename
 
-    # Parse BibTex entries
-    parser = biblib.bib.Parser(repeatKeySuffix="_REPEATKEY")
-    with open(filename) as f:
-        parser.parse(f, log_fp=sys.stderr)
 
-    entries = parser.get_entries()
+def parseBibTexFiles(files, processes=None, keyWhitelist=None, lazy=False, keepSources=False):
+    """
+    Parse several open BibTeX files as one database.
+    The files are parsed in order, so that every file sees the @string macros of the files before it.
+    :param files: Iterable of (file-like object, filename) pairs
+    :param processes: If greater than 1, parse each file with this many worker processes
+    :param keyWhitelist: If not None, skip all entries except those with these keys and the entries they cross-reference
+    :param lazy: If True, parse the fields of an entry only when they are first used
+    :param keepSources: If True, the parser also keeps the original text of the entries
+    :return: Dictionary mapping lower-cased keys to entries and the parser, which holds the macros
+    """
+    parser = biblib.bib.Parser(repeatKeySuffix=REPEAT_KEY_SUFFIX, keys=keyWhitelist, lazy=lazy,
+                               keep_source=keepSources)
+    recoverer = biblib.messages.InputErrorRecoverer()
+    for f, filename in files:
+        with recoverer:
+            if processes is not None and processes > 1:
+                parser.parse_parallel(f, filename, log_fp=biblib.messages.StderrLog(), processes=processes)
+            else:
+                parser.parse(f, filename, log_fp=biblib.messages.StderrLog())
+    recoverer.reraise()
+    return parser.get_entries(), parser
 
-    # # Resolve cross-references
-    # entries = biblib.bib.resolve_crossrefs(entries)
 
-    if loadPreamble:
-        return entries, preamble
-    else:
-        return entries
+def mapBibTexFiles(filenames, keyWhitelist=None, keepSources=False):
+    """
+    Parse several BibTeX files as one database by memory-mapping them.
+    Field values are decoded from the mapped files when they are first accessed, so the files should not be modified
+    while the entries are in use. The files are decoded like files opened in text mode.
+    :param filenames: List of file names
+    :param keyWhitelist: If not None, skip all entries except those with these keys and the entries they cross-reference
+    :param keepSources: If True, the parser also keeps the original text of the entries
+    :return: Dictionary mapping lower-cased keys to entries and the parser, which holds the macros
+    """
+    parser = biblib.bib.Parser(repeatKeySuffix=REPEAT_KEY_SUFFIX, keys=keyWhitelist, keep_source=keepSources)
+    encoding = locale.getpreferredencoding(False)
+    recoverer = biblib.messages.InputErrorRecoverer()
+    for filename in filenames:
+        with recoverer:
+            parser.parse_mmap(filename, encoding=encoding, log_fp=biblib.messages.StderrLog())
+    recoverer.reraise()
+    return parser.get_entries(), parser
+
+
+def getEntryFilename(entry):
+    """
+    Get the name of the BibTeX file an entry was loaded from.
+    :param entry:
+    :return:
+    """
+    return entry.pos.fname
+
+
+def loadCachedBibTex(filename, cacheDir, processes=None, keepSources=False):
+    """
+    Load the entries and preamble of a BibTeX file, using a persistent cache of parse results.
+
+    The cache is keyed by the absolute path of the file and only used if size, modification time and a hash of the
+    file content are unchanged; otherwise the file is parsed and the cache updated. The warnings of the parse are
+    stored with its results and printed again for every cache hit. Cache files are replaced atomically, so concurrent
+    runs can share a cache directory.
+    :param filename: Name of the file or list of file names, which are loaded as one database (see loadBibTex)
+    :param cacheDir:
+    :param processes: If greater than 1, parse the files with this many worker processes
+    :param keepSources: If True, also return the original text of the entries (see loadBibTex). The text is only stored
+                        in the cache if requested, so a cache written without it is updated.
+    :return: Dictionary mapping lower-cased keys to entries and the preamble
+    """
+    filenames = [filename] if isinstance(filename, str) else list(filename)
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        fileContents = list(executor.map(_readBytes, filenames))
+    fileInfo = {'version': CACHE_VERSION,
+                'files': [{'size': stat.st_size,
+                           'mtime': stat.st_mtime_ns,
+                           'hash': hashlib.sha256(data).hexdigest(),
+                           } for data, stat in fileContents],
+                }
+    paths = '\n'.join(os.path.abspath(name) for name in filenames)
+    cacheFile = os.path.join(cacheDir, '{}.pickle'.format(hashlib.sha256(paths.encode('utf-8')).hexdigest()))
+
+    cached = _loadCacheFile(cacheFile, fileInfo)
+    if cached is not None and not (keepSources and cached.get('sources') is None):
+        sys.stderr.write(cached['log'])
+        if keepSources:
+            return cached['entries'], cached['preamble'], cached['sources']
+        return cached['entries'], cached['preamble']
+
+    # Decode exactly like open() would, so the results do not depend on the cache
+    texts = [io.TextIOWrapper(io.BytesIO(data)).read() for data, stat in fileContents]
+    preamble = ''.join(readPreamble(io.StringIO(text)) for text in texts)
+    # The parser logs to whatever sys.stderr is, so its warnings can be recorded for later cache hits
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(log):
+            entries, parser = parseBibTexFiles([(io.StringIO(text), name) for text, name in zip(texts, filenames)],
+                                               processes, keepSources=keepSources)
+    finally:
+        sys.stderr.write(log.getvalue())
+    sources = parser.get_sources() if keepSources else None
+
+    _saveCacheFile(cacheFile, fileInfo, {'entries': entries,
+                                         'preamble': preamble,
+                                         'macros': parser.get_macros(),
+                                         'repeatedKeys': parser.get_repeated_key_dict(),
+                                         'sources': sources,
+                                         'log': log.getvalue(),
+                                         })
+    if keepSources:
+        return entries, preamble, sources
+    return entries, preamble
+
+
+def _readBytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read(), os.fstat(f.fileno())
+
+
+def _loadCacheFile(cacheFile, fileInfo):
+    try:
+        with open(cacheFile, 'rb') as f:
+            if pickle.load(f) != fileInfo:
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A cache file from an incompatible version or a crashed run
+        print('WARNING: Ignoring unreadable cache file {}: {}'.format(cacheFile, e), file=sys.stderr)
+        return None
+
+
+def _saveCacheFile(cacheFile, fileInfo, content):
+    os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+    # Write to a temporary file and rename it, so readers never see a partially written cache file
+    fd, tmpFile = tempfile.mkstemp(dir=os.path.dirname(cacheFile), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(fileInfo, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpFile, cacheFile)
+    except BaseException:
+        os.remove(tmpFile)
+        raise
+
+
+def readPreamble(filename):
+    """
+    Read the text preceding the first BibTeX entry of a file, e.g. BibDesk metadata and comment lines.
+    :param filename: Name of the file, or an iterable of its lines
+    :return:
+    """
+    if isinstance(filename, str):
+        with open(filename) as f:
+            return readPreamble(f)
+
+    preamble_lines = []
+    for line in filename:
+        if line.strip().startswith('@') and not line.strip().startswith('@comment{'):
+            break
+        else:
+            preamble_lines.append(line)
+    return ''.join(preamble_lines)
 
 
-def saveBibTex(filename, key2entry, preamble='', month_to_macro=True, wrap_width=70, bibdesk_compatible=False):
-    entryStrings = [entry.to_bib(month_to_macro=month_to_macro, wrap_width=wrap_width,
-                                 bibdesk_compatible=bibdesk_compatible) for entry in key2entry.values()]
-    text = '\n\n'.join(entryStrings)
-    with open(filename, 'w') as w:
+def saveBibTex(filename, key2entry, preamble='', month_to_macro=True, wrap_width=70, bibdesk_compatible=False,
+               key2source=None, processes=None):
+    """
+    Write entries to a BibTeX file.
+    The entries are formatted and written one at a time, so the complete output is never held in memory. They are
+    written to a temporary file next to filename, which only replaces filename once it is complete, so an interrupted
+    run never leaves a truncated file behind.
+    :param filename: Name of the file
+    :param key2entry: Dictionary mapping keys to entries, which are written in order
+    :param preamble: Text written before the first entry
+    :param key2source: If not None, dictionary mapping lower-cased keys to the original text of entries (see
+                       loadBibTex). The text of these entries is copied as it is instead of being formatted, so it
+                       must only contain entries that were not changed.
+    :param processes: If greater than 1, format the entries in batches of SAVE_BATCH_SIZE with this many worker
+                      processes. The file is the same as without them.
+    :return:
+    """
+    if key2source is None:
+        key2source = {}
+    formatOptions = dict(month_to_macro=month_to_macro, wrap_width=wrap_width, bibdesk_compatible=bibdesk_compatible)
+    if processes is not None and processes > 1:
+        texts = _formatEntriesInParallel(key2entry, key2source, formatOptions, processes)
+    else:
+        texts = _formatEntries(key2entry, key2source, formatOptions)
+    with openAtomic(filename) as w:
         w.write(preamble)
-        w.write(text)
+        for i, text in enumerate(texts):
+            if i > 0:
+                w.write('\n\n')
+            w.write(text)
         w.write('\n')
 
 
+def _formatEntries(key2entry, key2source, formatOptions):
+    for key, entry in key2entry.items():
+        source = key2source.get(key.lower())
+        if source is not None:
+            yield source
+        else:
+            yield entry.to_bib(**formatOptions)
+
+
+def _formatEntriesInParallel(key2entry, key2source, formatOptions, processes):
+    """
+    Format entries like _formatEntries, but in worker processes.
+    Only a few batches are formatted ahead of the one being written, so the complete output is never held in memory
+    either.
+    """
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = []
+        items = iter(key2entry.items())
+        while True:
+            batch = [(key2source.get(key.lower()), entry) for key, entry in itertools.islice(items, SAVE_BATCH_SIZE)]
+            if batch:
+                entries = [_getEntryToFormat(entry) for source, entry in batch if source is None]
+                pending.append((batch, executor.submit(_formatBatch, entries, formatOptions)))
+            if pending and (not batch or len(pending) > 2 * processes):
+                batch, future = pending.pop(0)
+                formatted = iter(future.result())
+                for source, entry in batch:
+                    if source is not None:
+                        yield source
+                        continue
+                    text, log = next(formatted)
+                    if log:
+                        # Pass on the error message about an unknown month
+                        logFp = entry.field_pos['month'].log_fp
+                        if logFp is not None:
+                            logFp.write(log)
+                    yield text
+            elif not batch:
+                break
+
+
+def _getEntryToFormat(entry):
+    # A plain copy of the entry is faster to send to a worker process. Of the positions, only the one of the month is
+    # used, for the error message of an unknown month, which the worker returns rather than logs
+    fieldPos = {}
+    if 'month' in entry:
+        pos = entry.field_pos['month']
+        fieldPos['month'] = biblib.messages.Pos(pos.fname, pos.line, pos.col, None)
+    return biblib.bib.Entry(entry, entry.typ, entry.key, None, fieldPos)
+
+
+def _formatBatch(entries, formatOptions):
+    results = []
+    for entry in entries:
+        log = io.StringIO()
+        if 'month' in entry.field_pos:
+            entry.field_pos['month'] = entry.field_pos['month']._replace(log_fp=log)
+        results.append((entry.to_bib(**formatOptions), log.getvalue()))
+    return results
+
+
+@contextlib.contextmanager
+def openAtomic(filename):
+    """
+    Open a text file for writing that replaces filename only once the with block completes.
+    The text is written to a temporary file in the same directory, which is renamed to filename at the end. If the
+    with block raises an exception, the temporary file is removed and filename is left unchanged. The permissions of
+    an existing file are kept, and a symbolic link is replaced by writing to its target.
+    :param filename: Name of the file
+    :return: Buffered text file object
+    """
+    filename = os.path.realpath(filename)
+    fd, tmpFile = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.{}.'.format(os.path.basename(filename)),
+                                   suffix='.tmp')
+    try:
+        with open(fd, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+            yield f
+        os.chmod(tmpFile, _getNewFileMode(filename))
+        os.replace(tmpFile, filename)
+    except BaseException:
+        os.remove(tmpFile)
+        raise
+
+
+def _getNewFileMode(filename):
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        # The mode open() would have used
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
 def loadCitedKeys(filename, lowercaseKeys=False):
     citationRE = re.compile(r"^\\citation{(.*)}$")
     keys = set()
@@ -472,10 +818,18 @@ def loadCitedKeys(filename, lowercaseKeys=False):
 
 
 def filterEntries(key2entry, keyWhitelist):
+    """
+    Select the entries whose keys are in keyWhitelist.
+    :param key2entry: Dictionary of entries or iterable of (key, entry) pairs
+    :param keyWhitelist:
+    :return:
+    """
     keyWhitelist = {k.lower() for k in keyWhitelist}
     filteredEntries = OrderedDict()
 
-    for key, entry in key2entry.items():
+    if hasattr(key2entry, 'items'):
+        key2entry = key2entry.items()
+    for key, entry in key2entry:
         key = key.lower()
         if key in keyWhitelist:
             filteredEntries[key] = entry
@@ -483,7 +837,91 @@ def filterEntries(key2entry, keyWhitelist):
     return filteredEntries
 
 
+class EntryTable(Mapping):
+    """
+    Column-oriented view of a dictionary of entries for checks that run over the whole bibliography.
+    For every field name, the table stores the values of all entries that have the field as one list (a column)
+    plus a presence bitmap with one byte per entry that is 1 if the entry has the field.
+    Columns can be selected with itertools.compress and turned into NumPy arrays without copying
+    (numpy.frombuffer) by code that wants to.
+
+    The table is a Mapping from keys to entries, so it can be passed to any function that accepts a dictionary
+    of entries. It is a snapshot: changing the entries afterwards does not update the columns.
+    """
+
+    def __init__(self, key2entry):
+        self.entryKeys = list(key2entry.keys())
+        self.entries = list(key2entry.values())
+        self.types = [entry.typ for entry in self.entries]
+        self._key2entry = OrderedDict(zip(self.entryKeys, self.entries))
+        self._columns = {}
+        self._presence = {}
+
+        for i, entry in enumerate(self.entries):
+            for field, value in entry.items():
+                if field not in self._columns:
+                    self._columns[field] = []
+                    self._presence[field] = bytearray(len(self.entries))
+                self._columns[field].append(value)
+                self._presence[field][i] = 1
+
+    def __getitem__(self, key):
+        return self._key2entry[key]
+
+    def __iter__(self):
+        return iter(self.entryKeys)
+
+    def __len__(self):
+        return len(self.entryKeys)
+
+    def fields(self):
+        return list(self._columns)
+
+    def column(self, field):
+        """
+        Get the values of a field.
+        :param field: Field name
+        :return: List of the values of all entries that have the field, in entry order
+        """
+        return self._columns.get(field, [])
+
+    def presence(self, field):
+        """
+        Get the presence bitmap of a field.
+        :param field: Field name
+        :return: Bytearray that is 1 for every entry that has the field and 0 otherwise
+        """
+        return self._presence.get(field, bytearray(len(self.entries)))
+
+    def select(self, items, field):
+        """
+        Select the items (a list with one element per entry) of the entries that have a field.
+        :param items: List that is parallel to the entries of the table, such as entryKeys, entries or types
+        :param field: Field name
+        :return: Iterator over the selected items, parallel to column(field)
+        """
+        return itertools.compress(items, self.presence(field))
+
+    def entriesWithField(self, field):
+        return zip(self.select(self.entryKeys, field), self.select(self.entries, field))
+
+
+def _joinColumn(values):
+    """
+    Join column values with newlines, so that they can be processed in one go.
+    :param values: List of strings
+    :return: Joined string, or None if a value contains a newline itself
+    """
+    joined = '\n'.join(values)
+    if joined.count('\n') != max(len(values) - 1, 0):
+        return None
+    return joined
+
+
 def getEntriesWithField(entries, field):
+    if isinstance(entries, EntryTable):
+        yield from entries.entriesWithField(field)
+        return
     for key, entry in entries.items():
         if field not in entry:
             continue
@@ -532,33 +970,38 @@ def getFieldAvailabilities(entries):
 
 
 def findDuplicateKeys(entries):
-    # Can not be checked for right now because biblib throws errors when encountering repeated keys
-
-    raise UserWarning("Finding duplicate keys is not yet implemented.")
+    """
+    Find keys that are used by more than one entry, e.g. by entries in different BibTeX files.
+    When loading, all but the first of these entries get REPEAT_KEY_SUFFIX appended to their key (once or more).
+    :param entries:
+    :return: Dictionary mapping lower-cased keys to the list of entries that use them, in order of occurrence
+    """
+    suffix = REPEAT_KEY_SUFFIX.lower()
+    key2entries = OrderedDict()
+    for key, entry in entries.items():
+        key = key.lower()
+        while key.endswith(suffix):
+            key = key[:-len(suffix)]
+        key2entries.setdefault(key, []).append(entry)
 
-    # duplicates = set()
-    # for entry in entries:
-    #     print(entry)
-    #     break
-    # return duplicates
+    key2duplicateEntries = OrderedDict()
+    for key, keyEntries in key2entries.items():
+        if len(keyEntries) >= 2:
+            key2duplicateEntries[key] = keyEntries
+    return key2duplicateEntries
 
 
 def findDuplicateTitles(entries, ignoredTypes=None, ignoreCurlyBraces=True, ignoreCaps=True):
     if ignoredTypes is None:
         ignoredTypes = []
+    if isinstance(entries, EntryTable):
+        return _findDuplicateTitlesInTable(entries, ignoredTypes, ignoreCurlyBraces, ignoreCaps)
     title2seenEntries = {}
     for key, entry in getEntriesWithField(entries, FIELD_TITLE):
         if entry.typ in ignoredTypes:
             continue
 
-        title = entry.get(FIELD_TITLE)
-
-        if ignoreCurlyBraces:
-            title = title.replace('{', '')
-            title = title.replace('}', '')
-        if ignoreCaps:
-            title = title.lower()
-
+        title = _normaliseTitle(entry.get(FIELD_TITLE), ignoreCurlyBraces, ignoreCaps)
         title2seenEntries.setdefault(title, []).append(entry)
 
     title2duplicateEntries = {}
@@ -569,19 +1012,193 @@ def findDuplicateTitles(entries, ignoredTypes=None, ignoreCurlyBraces=True, igno
     return title2duplicateEntries
 
 
-def findAllCapsName(entries, field):
-    entrykey2CapsNames = {}
-    recoverer = biblib.messages.InputErrorRecoverer()
-    for key, entry in getEntriesWithField(entries, field):
-        with recoverer:
-            authors = entry.authors(field)
+def _findDuplicateTitlesInTable(table, ignoredTypes, ignoreCurlyBraces, ignoreCaps):
+    keep = [typ not in ignoredTypes for typ in table.select(table.types, FIELD_TITLE)]
+    titleEntries = list(itertools.compress(table.select(table.entries, FIELD_TITLE), keep))
+    titles = list(itertools.compress(table.column(FIELD_TITLE), keep))
 
-            for author in authors:
-                capsElems = findAllCapsNameElement(author, entry)
-                if len(capsElems) > 0:
-                    capsNames = entrykey2CapsNames.setdefault(key, [])
-                    capsNames.append(author)
-    recoverer.reraise()
+    # Normalise the whole column at once
+    joined = _joinColumn(titles)
+    if joined is not None:
+        if ignoreCurlyBraces:
+            joined = joined.replace('{', '').replace('}', '')
+        if ignoreCaps:
+            joined = joined.lower()
+        titles = joined.split('\n') if titles else []
+    else:
+        titles = [_normaliseTitle(title, ignoreCurlyBraces, ignoreCaps) for title in titles]
+
+    title2seenEntries = {}
+    for title, entry in zip(titles, titleEntries):
+        title2seenEntries.setdefault(title, []).append(entry)
+
+    return {title: entries for title, entries in title2seenEntries.items() if len(entries) >= 2}
+
+
+def _normaliseTitle(title, ignoreCurlyBraces, ignoreCaps):
+    if ignoreCurlyBraces:
+        title = title.replace('{', '')
+        title = title.replace('}', '')
+    if ignoreCaps:
+        title = title.lower()
+    return title
+
+
+PersonOccurrence = namedtuple('PersonOccurrence', 'key entry field index name')
+
+
+def getPersonKey(name):
+    """
+    Get the key under which a PersonIndex groups a name.
+    :param name: biblib.algo.Name
+    :return: Tuple of the initials of the first names and the von, last and jr parts
+    """
+    return tuple(first[0] for first in name.first.split()), name.von, name.last, name.jr
+
+
+class PersonIndex:
+    """
+    Index of the person names in all entries, so that name checks and fixes parse every name field only once.
+    Every name is stored as a PersonOccurrence (entry key, entry, field, position in the field, Name)
+    and grouped by its person key (see getPersonKey).
+
+    Unlike EntryTable, the index is kept up to date: whoever changes a name field of an indexed entry
+    has to call updateField afterwards, or updateName for every name that was changed.
+    """
+
+    def __init__(self, key2entry, fields=PERSON_NAME_FIELDS):
+        self.fields = fields
+        self._slot2occurrences = OrderedDict()
+        self._slot2order = {}
+        self._person2occurrences = {}
+
+        recoverer = biblib.messages.InputErrorRecoverer()
+        for key, entry in key2entry.items():
+            for field in fields:
+                if field in entry:
+                    with recoverer:
+                        self.updateField(key, entry, field)
+        recoverer.reraise()
+
+    def updateField(self, key, entry, field):
+        """
+        (Re-)index the names of a field of an entry.
+        :param key: Key of the entry in the dictionary of entries
+        :param entry: Entry
+        :param field: Name field
+        """
+        slot = key, field
+        for occurrence in self._slot2occurrences.get(slot, ()):
+            person = getPersonKey(occurrence.name)
+            occurrences = self._person2occurrences[person]
+            del occurrences[(key, field, occurrence.index)]
+            if not occurrences:
+                del self._person2occurrences[person]
+
+        if field not in entry:
+            self._slot2occurrences.pop(slot, None)
+            return
+        # Reserve the slot before parsing, so that its position does not depend on whether parsing fails
+        self._slot2occurrences[slot] = []
+        self._slot2order.setdefault(slot, len(self._slot2order))
+        names = entry.authors(field)
+
+        slotOccurrences = []
+        for index, name in enumerate(names):
+            occurrence = PersonOccurrence(key, entry, field, index, name)
+            slotOccurrences.append(occurrence)
+            occurrences = self._person2occurrences.setdefault(getPersonKey(name), {})
+            occurrences[(key, field, index)] = occurrence
+        self._slot2occurrences[slot] = slotOccurrences
+
+    def updateName(self, key, field, index, name):
+        """
+        Replace one indexed name, without parsing the field again.
+        :param key: Key of the entry in the dictionary of entries
+        :param field: Name field
+        :param index: Position of the name in the field
+        :param name: New biblib.algo.Name
+        """
+        slotOccurrences = self._slot2occurrences[key, field]
+        occurrence = slotOccurrences[index]
+        person = getPersonKey(occurrence.name)
+        occurrences = self._person2occurrences[person]
+        del occurrences[(key, field, index)]
+        if not occurrences:
+            del self._person2occurrences[person]
+
+        occurrence = occurrence._replace(name=name)
+        slotOccurrences[index] = occurrence
+        self._person2occurrences.setdefault(getPersonKey(name), {})[(key, field, index)] = occurrence
+
+    def getNames(self, key, field):
+        """
+        Get the parsed names of a field of an entry.
+        :param key: Key of the entry in the dictionary of entries
+        :param field: Name field
+        :return: New list of biblib.algo.Name objects, empty if the entry has no such field
+        """
+        return [occurrence.name for occurrence in self._slot2occurrences.get((key, field), ())]
+
+    def getName(self, key, field, index):
+        """
+        Get one parsed name of a field of an entry.
+        :param key: Key of the entry in the dictionary of entries
+        :param field: Name field
+        :param index: Position of the name in the field
+        :return: biblib.algo.Name
+        """
+        return self._slot2occurrences[key, field][index].name
+
+    def getOccurrences(self, person):
+        """
+        Get all occurrences of a person.
+        :param person: Person key (see getPersonKey)
+        :return: List of PersonOccurrence objects, in entry order
+        """
+        occurrences = self._person2occurrences.get(person, {})
+        return sorted(occurrences.values(),
+                      key=lambda occurrence: (self._slot2order[occurrence.key, occurrence.field], occurrence.index))
+
+    def getPersons(self):
+        """
+        Get the keys of all indexed persons.
+        :return: List of person keys, in the order of their first occurrence
+        """
+        return list(OrderedDict.fromkeys(getPersonKey(occurrence.name) for occurrence in self.iterOccurrences()))
+
+    def iterOccurrences(self, field=None):
+        """
+        Iterate over the indexed names in entry order.
+        :param field: Only yield the names of this field if it is not None
+        :return: Iterator over PersonOccurrence objects
+        """
+        for (key, slotField), occurrences in self._slot2occurrences.items():
+            if field is None or slotField == field:
+                yield from occurrences
+
+    def __contains__(self, person):
+        return person in self._person2occurrences
+
+    def __len__(self):
+        return len(self._person2occurrences)
+
+
+def findAllCapsName(entries, field, personIndex=None):
+    """
+    Find names that are written in all-caps.
+    :param field: Name field
+    :param personIndex: PersonIndex of the entries, built here if None
+    :return: Dictionary from entry keys to lists of all-caps Name objects
+    """
+    if personIndex is None:
+        personIndex = PersonIndex(entries, fields=[field])
+    entrykey2CapsNames = {}
+    for occurrence in personIndex.iterOccurrences(field):
+        capsElems = findAllCapsNameElement(occurrence.name, occurrence.entry)
+        if len(capsElems) > 0:
+            capsNames = entrykey2CapsNames.setdefault(occurrence.key, [])
+            capsNames.append(occurrence.name)
     return entrykey2CapsNames
 
 
@@ -675,9 +1292,31 @@ def findBadPageNumbers(entries, tolerateSingleHyphens=True):
     else:
         pageRE = re.compile(r'^{0}(,{0})*$'.format(r'\d+((\-\-\d+)|(\+))?'))
 
+    if isinstance(entries, EntryTable):
+        return _findBadPageNumbersInTable(entries, pageRE)
+
     badEntries = []
     for key, entry in getEntriesWithField(entries, FIELD_PAGES):
         pages = entry[FIELD_PAGES]
         if not pageRE.match(pages):
             badEntries.append(entry)
     return badEntries
+
+
+def _findBadPageNumbersInTable(table, pageRE):
+    pagesColumn = table.column(FIELD_PAGES)
+    pagesEntries = table.select(table.entries, FIELD_PAGES)
+    joined = _joinColumn(pagesColumn)
+    if joined is None:
+        return [entry for pages, entry in zip(pagesColumn, pagesEntries) if not pageRE.match(pages)]
+
+    # Match the whole column at once and find the lines that did not match
+    lineRE = re.compile(pageRE.pattern, re.MULTILINE)
+    goodStarts = {match.start() for match in lineRE.finditer(joined)}
+    badEntries = []
+    start = 0
+    for pages, entry in zip(pagesColumn, pagesEntries):
+        if start not in goodStarts:
+            badEntries.append(entry)
+        start += len(pages) + 1
+    return badEntries
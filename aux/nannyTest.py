@@ -1,10 +1,14 @@
 import sys
+import os
+import io
+import contextlib
+import tempfile
 from unittest import TestCase, expectedFailure
 from collections import OrderedDict
 
 import fixer
 from aux import nanny
-from aux.biblib import bib, algo
+from aux.biblib import bib, algo, messages
 
 
 TYPEFIELD = '@type'
@@ -42,6 +46,208 @@ def getStringEntry(field2value, key=DEFAULT_KEY):
     return entry
 
 
+class TestBibTexCache(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.cacheDir = os.path.join(self.tempDir.name, 'cache')
+        self.filename = os.path.join(self.tempDir.name, 'test.bib')
+        self.writeBibTex(getStringEntries([{FIELD_TITLE: 'First title'}, {FIELD_TITLE: 'Second title'}]))
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def writeBibTex(self, text):
+        with open(self.filename, 'w') as f:
+            f.write('% Preamble\n' + text)
+
+    def test_loadBibTex_cacheHit(self):
+        entries, preamble = nanny.loadBibTex(self.filename, loadPreamble=True, cacheDir=self.cacheDir)
+        cachedEntries, cachedPreamble = nanny.loadBibTex(self.filename, loadPreamble=True, cacheDir=self.cacheDir)
+        self.assertEqual(list(entries.items()), list(cachedEntries.items()))
+        self.assertEqual(preamble, cachedPreamble)
+        self.assertEqual(str(entries['foobar1'].pos), str(cachedEntries['foobar1'].pos))
+
+    def test_loadBibTex_cacheProcesses(self):
+        self.writeBibTex(getStringEntries([{FIELD_AUTHOR: 'Mouse, Mickey,'}] * 50))
+        entries = nanny.loadBibTex(self.filename, processes=2, cacheDir=self.cacheDir)
+        # Positions must not refer to the log files of the parse that wrote the cache
+        for cacheFile in os.listdir(self.cacheDir):
+            with open(os.path.join(self.cacheDir, cacheFile), 'rb') as f:
+                self.assertNotIn(b'_ShardLog', f.read())
+        cachedEntries = nanny.loadBibTex(self.filename, processes=2, cacheDir=self.cacheDir)
+        self.assertEqual(list(entries.items()), list(cachedEntries.items()))
+        self.assertIsInstance(cachedEntries['foobar49'].field_pos[FIELD_AUTHOR].log_fp, messages.StderrLog)
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            cachedEntries['foobar49'].authors()
+        self.assertIn('warning: trailing comma', stderr.getvalue())
+
+    def test_loadBibTex_cacheWarnings(self):
+        self.writeBibTex('@misc{foobar0, title={A}, title={B}, note=foo}\n')
+        logs = []
+        for _ in range(2):
+            stderr = io.StringIO()
+            with contextlib.redirect_stderr(stderr):
+                nanny.loadBibTex(self.filename, cacheDir=self.cacheDir)
+            logs.append(stderr.getvalue())
+        self.assertIn("warning: repeated field `title'", logs[0])
+        self.assertIn("warning: unknown macro `foo'", logs[0])
+        self.assertEqual(logs[1], logs[0])
+
+    def test_loadBibTex_cacheSources(self):
+        entries, key2source = nanny.loadBibTex(self.filename, keepSources=True)
+        self.assertTrue(key2source)
+        # A cache written without the sources is updated
+        nanny.loadBibTex(self.filename, cacheDir=self.cacheDir)
+        for _ in range(2):
+            cachedEntries, cachedKey2source = nanny.loadBibTex(self.filename, cacheDir=self.cacheDir,
+                                                               keepSources=True)
+            self.assertEqual(cachedKey2source, key2source)
+
+    def test_loadBibTex_cacheInvalidated(self):
+        nanny.loadBibTex(self.filename, cacheDir=self.cacheDir)
+        self.writeBibTex(getStringEntries([{FIELD_TITLE: 'Changed title'}]))
+        entries = nanny.loadBibTex(self.filename, cacheDir=self.cacheDir)
+        self.assertEqual(list(entries), [DEFAULT_KEY_START + '0'])
+        self.assertEqual(entries[DEFAULT_KEY_START + '0'][FIELD_TITLE.lower()], 'Changed title')
+
+
+class TestLoadMultipleFiles(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.filenames = [os.path.join(self.tempDir.name, name) for name in ('shared.bib', 'project.bib')]
+        with open(self.filenames[0], 'w') as f:
+            f.write('@string{conf = {Shared Conference}}\n' + getStringEntry({'booktitle': 'X'}))
+        with open(self.filenames[1], 'w') as f:
+            f.write('@misc{other, booktitle = conf}\n' + getStringEntry({'booktitle': 'Y'}))
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def test_loadBibTex_multipleFiles(self):
+        entries = nanny.loadBibTex(self.filenames)
+        self.assertEqual(list(entries), [DEFAULT_KEY.lower(), 'other', (DEFAULT_KEY + nanny.REPEAT_KEY_SUFFIX).lower()])
+        self.assertEqual(entries['other']['booktitle'], 'Shared Conference')
+        self.assertEqual([nanny.getEntryFilename(entry) for entry in entries.values()],
+                         [self.filenames[0], self.filenames[1], self.filenames[1]])
+        self.assertEqual(list(nanny.findDuplicateKeys(entries)), [DEFAULT_KEY.lower()])
+
+    def test_loadBibTex_multipleFilesCached(self):
+        cacheDir = os.path.join(self.tempDir.name, 'cache')
+        entries = nanny.loadBibTex(self.filenames)
+        for i in range(2):
+            cachedEntries = nanny.loadBibTex(self.filenames, cacheDir=cacheDir)
+            self.assertEqual(list(entries.items()), list(cachedEntries.items()))
+
+
+class TestLoadBibTexWhitelist(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempDir.name, 'test.bib')
+        with open(self.filename, 'w') as f:
+            f.write('@proceedings{before, title={Before}}\n'
+                    '@inproceedings{cited, title={Cited}, crossref={before}}\n'
+                    '@misc{uncited, title={Uncited}}\n')
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def test_loadBibTex_keyWhitelist(self):
+        entries = nanny.loadBibTex(self.filename, keyWhitelist=['Cited'])
+        self.assertEqual(list(entries), ['cited'])
+
+    def test_loadBibTex_crossrefAfter(self):
+        with open(self.filename, 'w') as f:
+            f.write('@inproceedings{cited, title={Cited}, crossref={after}}\n'
+                    '@misc{uncited, title={Uncited}}\n'
+                    '@proceedings{after, title={After}, year=2000}\n')
+        entries = nanny.loadBibTex(self.filename, keyWhitelist=['Cited'], resolveCrossrefs=True)
+        self.assertEqual(list(entries), ['cited', 'after'])
+        self.assertEqual(entries['cited']['year'], '2000')
+
+    def test_loadBibTex_countEntries(self):
+        entries, entryCount = nanny.loadBibTex(self.filename, keyWhitelist=['Cited'], countEntries=True)
+        self.assertEqual(entryCount, 3)
+        entries, entryCount = nanny.loadBibTex(self.filename, keyWhitelist=['Cited'], memoryMap=True,
+                                               countEntries=True)
+        self.assertEqual(entryCount, 3)
+
+    def test_loadBibTex_memoryMap(self):
+        entries = nanny.loadBibTex(self.filename, keyWhitelist=['Cited'], memoryMap=True)
+        self.assertEqual(list(entries), ['cited'])
+        self.assertEqual(entries['cited']['title'], 'Cited')
+
+    def test_loadBibTex_lazy(self):
+        entries = nanny.loadBibTex(self.filename, keyWhitelist=['Cited'], lazy=True)
+        self.assertEqual(list(entries), ['cited'])
+        self.assertEqual(entries['cited']['title'], 'Cited')
+
+
+class TestSaveBibTex(TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tempDir.name, 'test.bib')
+        with open(self.filename, 'w') as f:
+            f.write('old')
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def test_saveBibTex(self):
+        entries = parse('@misc{a, title={A}}\n@misc{b, year=2000}')
+        nanny.saveBibTex(self.filename, entries, preamble='% preamble\n\n')
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), '% preamble\n\n@misc{a,\n  title        = {A},\n}\n\n'
+                                       '@misc{b,\n  year         = 2000,\n}\n')
+
+    def test_saveBibTex_key2source(self):
+        entries = parse('@misc{a, title={A}}\n@misc{b, year=2000}')
+        nanny.saveBibTex(self.filename, entries, key2source={'b': '@misc{b,year=2000}'})
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), '@misc{a,\n  title        = {A},\n}\n\n@misc{b,year=2000}\n')
+
+    def test_saveBibTex_processes(self):
+        entries = parse(''.join('@misc{{k{0}, title={{Title {0}}}, month=jun}}\n'.format(i) for i in range(2500)))
+        key2source = {'k7': '@misc{k7}'}
+        nanny.saveBibTex(self.filename, entries, key2source=key2source)
+        with open(self.filename) as f:
+            serial = f.read()
+        nanny.saveBibTex(self.filename, entries, key2source=key2source, processes=2)
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), serial)
+
+    def test_saveBibTex_interrupted(self):
+        class BrokenEntry:
+            def to_bib(self, **kwargs):
+                raise KeyboardInterrupt()
+
+        entries = parse('@misc{a, title={A}}')
+        entries['b'] = BrokenEntry()
+        with self.assertRaises(KeyboardInterrupt):
+            nanny.saveBibTex(self.filename, entries)
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.tempDir.name), ['test.bib'])
+
+
+class TestTextConverter(TestCase):
+    def test_convert(self):
+        converter = fixer.TextConverter(maxSize=2)
+        for text in [r'\"a', r'\"a', r'\"o', r'\"u', r'\"a']:
+            self.assertEqual(converter.convert(converter.LATEX2UNICODE, text), fixer.convertLaTeX2Unicode(text))
+        self.assertEqual((converter.hits, converter.misses), (1, 4))
+
+    def test_convertColumn(self):
+        converter = fixer.TextConverter()
+        column = [r'M{\"u}ller', 'Smith', r'M{\"u}ller', 'Smith', 'Smith']
+        directions = [converter.LATEX2UNICODE, converter.UNICODE2BIBTEX]
+        value2converted = converter.convertColumn(column, directions)
+        self.assertEqual(value2converted, {value: fixer.convertUnicode2BibTeX(fixer.convertLaTeX2Unicode(value))
+                                           for value in column})
+        self.assertEqual((converter.hits, converter.misses), (6, 4))
+        self.assertEqual(converter.getHitRate(), 0.6)
+
+
 class TestUnicode2BibTeX(TestCase):
     def convert2bibtex(self, text):
         text = fixer.convertLaTeX2Unicode(text)
@@ -221,6 +427,72 @@ class TestFindUnsecuredUppercase(TestCase):
         self.assertEqual(key2unsecuredChars, key2goldChars)
 
 
+class TestEntryTable(TestCase):
+    ENTRIES = [{TYPEFIELD: 'article', FIELD_TITLE: 'A {T}itle', FIELD_PAGES: '1--2'},
+               {TYPEFIELD: 'misc', FIELD_TITLE: 'A title', FIELD_PAGES: '3 - 4'},
+               {TYPEFIELD: 'article', FIELD_TITLE: 'Other Title'},
+               {TYPEFIELD: 'article', FIELD_TITLE: 'a {t}itle', FIELD_PAGES: '5-6'}]
+
+    def test_columns(self):
+        table = nanny.EntryTable(parse(getStringEntries(self.ENTRIES)))
+        self.assertEqual(table.column('pages'), ['1--2', '3 - 4', '5-6'])
+        self.assertEqual(list(table.presence('pages')), [1, 1, 0, 1])
+        self.assertEqual(list(table), ['foobar0', 'foobar1', 'foobar2', 'foobar3'])
+
+    def test_sameAsDict(self):
+        entries = parse(getStringEntries(self.ENTRIES))
+        table = nanny.EntryTable(entries)
+        self.assertEqual(nanny.findDuplicateTitles(table, ['misc']),
+                         nanny.findDuplicateTitles(entries, ['misc']))
+        self.assertEqual(nanny.findBadPageNumbers(table, tolerateSingleHyphens=False),
+                         nanny.findBadPageNumbers(entries, tolerateSingleHyphens=False))
+        self.assertEqual(nanny.findUnsecuredUppercase(table, field='title'),
+                         nanny.findUnsecuredUppercase(entries, field='title'))
+        self.assertEqual(nanny.getFieldAvailabilities(table), nanny.getFieldAvailabilities(entries))
+
+
+class TestPersonIndex(TestCase):
+    ENTRIES = [{FIELD_AUTHOR: 'Mouse, M. and Duck, Donald'},
+               {FIELD_AUTHOR: 'Mickey Mouse', 'editor': 'D. Duck'},
+               {FIELD_TITLE: 'No names'}]
+
+    def test_occurrences(self):
+        index = nanny.PersonIndex(parse(getStringEntries(self.ENTRIES)))
+        self.assertEqual(index.getPersons(), [(('M',), '', 'Mouse', ''), (('D',), '', 'Duck', '')])
+        occurrences = index.getOccurrences((('D',), '', 'Duck', ''))
+        self.assertEqual([(o.key, o.field, o.index, o.name.first) for o in occurrences],
+                         [('foobar0', 'author', 1, 'Donald'), ('foobar1', 'editor', 0, 'D.')])
+        self.assertEqual(index.getOccurrences((('X',), '', 'Nobody', '')), [])
+        self.assertEqual(index.getNames('foobar2', 'author'), [])
+
+    def test_updateField(self):
+        entries = parse(getStringEntries(self.ENTRIES))
+        index = nanny.PersonIndex(entries)
+        entries['foobar0']['author'] = 'Mouse, Minnie'
+        index.updateField('foobar0', entries['foobar0'], 'author')
+        self.assertEqual([o.key for o in index.getOccurrences((('D',), '', 'Duck', ''))], ['foobar1'])
+        self.assertEqual(index.getNames('foobar0', 'author'), [algo.Name('Minnie', '', 'Mouse', '')])
+        # Occurrences stay in entry order after an update
+        self.assertEqual([o.key for o in index.getOccurrences((('M',), '', 'Mouse', ''))], ['foobar0', 'foobar1'])
+
+    def test_updateName(self):
+        index = nanny.PersonIndex(parse(getStringEntries(self.ENTRIES)))
+        index.updateName('foobar1', 'editor', 0, algo.Name('Dewey', '', 'Duck', ''))
+        self.assertEqual(index.getName('foobar1', 'editor', 0), algo.Name('Dewey', '', 'Duck', ''))
+        self.assertEqual([o.name.first for o in index.getOccurrences((('D',), '', 'Duck', ''))], ['Donald', 'Dewey'])
+        index.updateName('foobar1', 'editor', 0, algo.Name('Huey Dewey', '', 'Duck', ''))
+        self.assertEqual([o.key for o in index.getOccurrences((('D',), '', 'Duck', ''))], ['foobar0'])
+        self.assertEqual([o.index for o in index.getOccurrences((('H', 'D'), '', 'Duck', ''))], [0])
+
+    def test_fixIncompleteNames(self):
+        entries = parse(getStringEntries(self.ENTRIES))
+        index = nanny.PersonIndex(entries)
+        fixer.fixIncompleteNames(entries, fixer.ChangeLogger(), index)
+        self.assertEqual(entries['foobar0']['author'], 'Mouse, Mickey and Duck, Donald')
+        self.assertEqual(entries['foobar1']['editor'], 'Duck, Donald')
+        self.assertEqual(index.getNames('foobar1', 'editor'), [algo.Name('Donald', '', 'Duck', '')])
+
+
 class TestBadPageNumbers(TestCase):
     def test_fixBadPageNumbers_range_correct(self):
         bad_range = '153--176'
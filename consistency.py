@@ -70,17 +70,19 @@ def getEnumerationString(entries, quotes=None):
         return ''.join(elems)
 
 
-def checkConsistency(entries, config):
+def checkConsistency(entries, config, key2duplicateEntries=None):
     # Check for Duplicates #
     # Duplicate keys
+    # Entries with repeated keys are dropped when entries are selected by key, so these can be found beforehand
     if config.duplicateKeys:
-        print(NOT_IMPLEMENTED_PATTERN.format("Duplicate Keys"))
-        # duplicateKeys = nanny.findDuplicateKeys(entries)
-        # if duplicateKeys:
-        #     print(HEADLINE_PATTERN.format("Duplicate Keys"))
-        #     for duplicateKey in duplicateKeys:
-        #         print("Found duplicate key:".format(duplicateKey))
-        #     print()
+        if key2duplicateEntries is None:
+            key2duplicateEntries = nanny.findDuplicateKeys(entries)
+        if key2duplicateEntries:
+            print(HEADLINE_PATTERN.format("Duplicate Keys"))
+            for duplicateKeyEntries in key2duplicateEntries.values():
+                filenames = ', '.join(nanny.getEntryFilename(entry) for entry in duplicateKeyEntries)
+                print("Found duplicate key {} in {}".format(duplicateKeyEntries[0].key, filenames))
+            print()
 
     # Duplicate titles
     # Todo: Add handling of acceptable cases, such as different editions of a book, preprints and talks.
@@ -153,8 +155,9 @@ def checkConsistency(entries, config):
 
     # All-caps name formatting
     if config.allcapsNames:
+        personIndex = nanny.PersonIndex(entries)
         for field in nanny.PERSON_NAME_FIELDS:
-            entrykey2CapsNames = nanny.findAllCapsName(entries, field)
+            entrykey2CapsNames = nanny.findAllCapsName(entries, field, personIndex)
             if entrykey2CapsNames:
                 print(HEADLINE_PATTERN.format("{}s whose names are all-caps".format(field.capitalize())))
                 for key, capsnames in entrykey2CapsNames.items():
@@ -179,25 +182,32 @@ def checkConsistency(entries, config):
 
 def main():
     parser = argparse.ArgumentParser(description='Check the consistency of BibTeX entries.')
-    parser.add_argument('bibtexfile')
+    parser.add_argument('bibtexfile', nargs='+', help='One or more BibTeX files, which are combined in order')
     parser.add_argument('-a', '--aux')
     parser.add_argument('-c', '--config')
-    # TODO: Allow multiple bibtex files
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes used to parse the BibTeX file')
+    parser.add_argument('--cache-dir', help='Directory in which to cache parsed BibTeX files between runs')
     args = parser.parse_args()
 
     # Load BibTex file
-    entries = nanny.loadBibTex(args.bibtexfile)
-
-    # Load auxiliary file
+    # Without a cache, uncited entries are skipped by the parser
+    keyWhitelist = None
     if args.aux:
         keyWhitelist = nanny.loadCitedKeys(args.aux)
+    entries = nanny.loadBibTex(args.bibtexfile, processes=args.jobs, cacheDir=args.cache_dir, keyWhitelist=keyWhitelist)
+    key2duplicateEntries = None
+    if args.aux:
+        # Find the cited keys used more than once before their repeats are dropped with the uncited entries
+        citedKeys = {key.lower() for key in keyWhitelist}
+        key2duplicateEntries = {key: duplicateEntries for key, duplicateEntries
+                                in nanny.findDuplicateKeys(entries).items() if key in citedKeys}
         entries = nanny.filterEntries(entries, keyWhitelist)
 
     # Load config file
     config = ConsistencyConfig(args.config)
 
     # Processing
-    checkConsistency(entries, config)
+    checkConsistency(nanny.EntryTable(entries), config, key2duplicateEntries)
 
 
 if __name__ == '__main__':
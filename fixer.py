@@ -17,6 +17,12 @@ NOT_IMPLEMENTED_PATTERN = "Auto-fix for {} not yet implemented"
 
 RE_PAGES_RANGE = re.compile(r'(?P<num1>[0-9]+)(\s*(-+|–|—)\s*)(?P<num2>[0-9]+)')
 
+CONVERSION_CACHE_SIZE = 100000  # Number of converted strings remembered by a TextConverter
+
+RE_BIBTEX_CHARS = re.compile('[{}]'.format(re.escape(''.join(unicode2bibtex))))
+RE_ASCII_BIBTEX_CHARS = re.compile('[{}]'.format(re.escape(''.join(char for char in unicode2bibtex if char.isascii()))))
+RE_MATH_OR_COMBINING = re.compile('[${}]'.format(''.join(unicodeCombiningCharacter2bibtex)))
+
 
 class FixerConfig(nanny.NannyConfig):
     SECTION = 'Fixer'
@@ -125,6 +131,7 @@ class ChangeLogger:
         self.verbosity = verbosity
         self.currentKey = None
         self.key2changes = OrderedDict()
+        self.notes = []
 
     def __str__(self):
         self.getLog()
@@ -174,6 +181,8 @@ class ChangeLogger:
                 indent = ' ' * (max_digits - digits)
                 lines.append('  {}{} x {}'.format(indent, count, event))
 
+        lines.extend(self.notes)
+
         return '\n'.join(lines)
 
     def containsChanges(self):
@@ -194,6 +203,12 @@ class ChangeLogger:
     def addChange4CurrentEntry(self, info, original, changed):
         self.addChange(self.currentKey, info, original, changed)
 
+    def addNote(self, note):
+        """
+        Add a line to the end of the summary.
+        """
+        self.notes.append(note)
+
     def printLog(self):
         if self.containsChanges:
             if self.verbosity >= FixerSilentModeConfig.SHOW:
@@ -204,7 +219,79 @@ class ChangeLogger:
                 print()
 
 
-def fixEntries(entries, config, show):
+class TextConverter:
+    """
+    Converts strings between LaTeX, Unicode and BibTeX and remembers the results.
+    Values like journals, publishers and addresses occur in many entries, so the results for the
+    CONVERSION_CACHE_SIZE most recently used strings are kept, keyed by the direction of the conversion and the string.
+    """
+    LATEX2UNICODE = 'LaTeX to Unicode'
+    UNICODE2BIBTEX = 'Unicode to BibTeX'
+
+    def __init__(self, maxSize=CONVERSION_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.direction2function = {self.LATEX2UNICODE: convertLaTeX2Unicode,
+                                   self.UNICODE2BIBTEX: convertUnicode2BibTeX}
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def convert(self, direction, string):
+        """
+        Convert a string.
+        :param direction: LATEX2UNICODE or UNICODE2BIBTEX
+        :param string:
+        :return: Converted string
+        """
+        cacheKey = (direction, string)
+        converted = self.cache.get(cacheKey)
+        if converted is None:
+            self.misses += 1
+            converted = self.direction2function[direction](string)
+            self.cache[cacheKey] = converted
+            if len(self.cache) > self.maxSize:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(cacheKey)
+        return converted
+
+    def convertColumn(self, values, directions):
+        """
+        Convert a column of values, such as the values of one field in all entries (see nanny.EntryTable.column).
+        Every distinct value is only converted once. Repeated values count as cache hits.
+        :param values: List of strings
+        :param directions: List of directions (see convert) that are applied one after the other
+        :return: Dictionary mapping every distinct value to its conversion
+        """
+        value2converted = dict.fromkeys(values)
+        self.hits += (len(values) - len(value2converted)) * len(directions)
+        for value in value2converted:
+            converted = value
+            for direction in directions:
+                converted = self.convert(direction, converted)
+            value2converted[value] = converted
+        return value2converted
+
+    def getHitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def getSummary(self):
+        return '{} of {} conversions ({:.1%}) reused a previous result'.format(self.hits, self.hits + self.misses,
+                                                                               self.getHitRate())
+
+
+def fixEntries(entries, config, show, converter=None):
+    """
+    Fix the entries in place.
+    :param converter: TextConverter used for LaTeX/Unicode conversions; a new one if None
+    :return: Set of the keys of the entries that were changed, including renamed entries
+    """
+    key2originalState = {key: getEntryState(entry) for key, entry in entries.items()}
+    if converter is None:
+        converter = TextConverter()
+
     # Fix encoding #
     # LaTeX to BibTex formatting
     if config.latex2unicode or config.unicode2bibtex:
@@ -218,25 +305,35 @@ def fixEntries(entries, config, show):
             logger = ChangeLogger("Converting Unicode to BibTeX",
                                   verbosity=show.unicode2bibtex)
 
+        directions = []
+        if config.latex2unicode:
+            directions.append(TextConverter.LATEX2UNICODE)
+        if config.unicode2bibtex:
+            directions.append(TextConverter.UNICODE2BIBTEX)
+        # Convert the distinct values of a field once, when the field is first seen,
+        # and drop the conversions after the last entry with the field
+        table = nanny.EntryTable(entries)
+        field2conversions = {}
+        field2remaining = {}
+
         for entry_key, entry in entries.items():
             logger.setCurrentKey(entry_key)
             for field, value in entry.items():
-                convertedValue = value
-                # if '&' in value:
-                #     print('@@@', convertedValue)
-                if config.latex2unicode:
-                    convertedValue = convertLaTeX2Unicode(convertedValue)
-                    # if '&' in value:
-                    #     print('###', convertedValue)
-                if config.unicode2bibtex:
-                    convertedValue = convertUnicode2BibTeX(convertedValue)
-                    # if '&' in value:
-                    #     print('$$$', convertedValue)
-                    #     print()
-
+                conversions = field2conversions.get(field)
+                if conversions is None:
+                    column = table.column(field)
+                    conversions = converter.convertColumn(column, directions)
+                    field2conversions[field] = conversions
+                    field2remaining[field] = len(column)
+                field2remaining[field] -= 1
+                if not field2remaining[field]:
+                    del field2conversions[field]
+                convertedValue = conversions[value]
                 if convertedValue != value:
                     entry[field] = convertedValue
                     logger.addChange4CurrentEntry('Converted LaTeX to Unicode', value, convertedValue)
+        del table, field2conversions
+        logger.addNote(converter.getSummary())
         logger.printLog()
 
     # Check for Duplicates #
@@ -315,11 +412,17 @@ def fixEntries(entries, config, show):
     if config.inconsistentConferences:
         print(NOT_IMPLEMENTED_PATTERN.format("inconsistent names for conferences"))
 
+    # Parse the person names of all entries once for the name fixes below
+    personIndex = None
+    if config.ambiguousNames or config.incompleteNames:
+        personIndex = nanny.PersonIndex(entries)
+
     # Ambiguous name formatting
     if config.ambiguousNames:
         logger = ChangeLogger("Fixing BibTex author name formatting",
                               verbosity=show.ambiguousNames)
-        badNameEntries = fixNameFormat(entries, logger, not config.latex2unicode, not config.unicode2bibtex)
+        badNameEntries = fixNameFormat(entries, logger, not config.latex2unicode, not config.unicode2bibtex, converter,
+                                       personIndex)
         logger.printLog()
 
     # All-caps name formatting
@@ -330,7 +433,7 @@ def fixEntries(entries, config, show):
     if config.incompleteNames:
         logger = ChangeLogger("Completing incomplete names (initials to names, non-ASCII spellings)",
                               verbosity=show.incompleteNames)
-        fixIncompleteNames(entries, logger)
+        fixIncompleteNames(entries, logger, personIndex)
         logger.printLog()
 
     # Inconsistent location names
@@ -387,6 +490,12 @@ def fixEntries(entries, config, show):
                 logger.addChange4CurrentEntry('Removed conference acronym', booktitle, fixedBooktitle)
         logger.printLog()
 
+    return {key for key, entry in entries.items() if key2originalState.get(key) != getEntryState(entry)}
+
+
+def getEntryState(entry):
+    return entry.key, entry.typ, tuple(entry.items())
+
 
 def fixUnsecuredUppercase(text, unsecuredChars):
     unsecuredChars = set(unsecuredChars)
@@ -413,7 +522,16 @@ def fixBadPageNumbers(pages):
     return pages
 
 
-def fixNameFormat(entries, logger, fixLaTeX=True, fixUnicode=True):
+def fixNameFormat(entries, logger, fixLaTeX=True, fixUnicode=True, converter=None, personIndex=None):
+    """
+    Fix the formatting of the names in the person name fields of the entries in place.
+    :param personIndex: nanny.PersonIndex of the entries, which is updated along with them; built here if None
+    :return: Dictionary of the entries that were changed
+    """
+    if converter is None:
+        converter = TextConverter()
+    if personIndex is None:
+        personIndex = nanny.PersonIndex(entries)
     key2badEntries = OrderedDict()
     for entry_key, entry in entries.items():
         logger.setCurrentKey(entry_key)
@@ -421,7 +539,7 @@ def fixNameFormat(entries, logger, fixLaTeX=True, fixUnicode=True):
         isBadEntry = False
         for field in nanny.PERSON_NAME_FIELDS:
             if field in entry:
-                names = entry.authors(field)
+                names = personIndex.getNames(entry_key, field)
 
                 # Check name formatting
                 names_string = getNamesString(names)
@@ -433,7 +551,7 @@ def fixNameFormat(entries, logger, fixLaTeX=True, fixUnicode=True):
                     if name.is_others():
                         fixed_names.append(name)
                     else:
-                        fixed_name = fixControlSequences(name, logger, fixLaTeX, fixUnicode)
+                        fixed_name = fixControlSequences(name, logger, fixLaTeX, fixUnicode, converter)
                         fixed_name = fixNameInitials(fixed_name, logger)
                         fixed_name = fixAllCapsNames(fixed_name, logger)
                         fixed_names.append(fixed_name)
@@ -444,6 +562,7 @@ def fixNameFormat(entries, logger, fixLaTeX=True, fixUnicode=True):
                     isBadEntry = True
                     # print(names_string)
                     entry[field] = names_string
+                    personIndex.updateField(entry_key, entry, field)
                     try:
                         names_string.encode('ascii')
                     except UnicodeEncodeError:
@@ -456,18 +575,26 @@ def fixNameFormat(entries, logger, fixLaTeX=True, fixUnicode=True):
     return key2badEntries
 
 
-def fixIncompleteNames(entries, logger):
+def fixIncompleteNames(entries, logger, personIndex=None):
+    """
+    Expand initials to the full first names that are used for the same person in other entries.
+    :param personIndex: nanny.PersonIndex of the entries, which is updated along with them; built here if None
+    """
     # Expand initials to names
     print('Expand initials to names')
     initialRE = re.compile(r'(\w)\.?')
 
-    last2extnames = {}
+    if personIndex is None:
+        personIndex = nanny.PersonIndex(entries)
 
-    allExtNames = ExtendedName.getExtendedNames(entries, logger)
-    for extName in allExtNames:
-        last2extnames.setdefault(extName.getSimilarityKey(), []).append(extName)
+    person2extnames = OrderedDict()
+    changedSlots = OrderedDict()
+    for person in personIndex.getPersons():
+        person2extnames[person] = [ExtendedName(occurrence.name, occurrence.entry, occurrence.field, occurrence.index,
+                                                logger, personIndex, occurrence.key)
+                                   for occurrence in personIndex.getOccurrences(person)]
 
-    for last, extnames in last2extnames.items():
+    for person, extnames in person2extnames.items():
         foundInitial = False
         bestNames = []
         for extname in extnames:
@@ -507,18 +634,24 @@ def fixIncompleteNames(entries, logger):
 
         if len(bestNames) == 1:
             for extname in extnames:
-
-                extname.fixFirstName(bestNames[0])
+                if extname.fixFirstName(bestNames[0]):
+                    changedSlots[extname.key, extname.field] = extname.entry
         elif len(bestNames) > 1 and foundInitial:
             prettyLastName = extnames[0].getPrettyLastName()
             print("Fixing incomplete name: Could not disambiguate {} between {}".format(
                 "{}. {}".format(bestNames[0][0][0], prettyLastName),
                 ' and '.join(["{} {}".format(' '.join(bestElems), prettyLastName) for bestElems in bestNames])))
 
+    # Write every changed field once, after all of its names were fixed
+    for (key, field), entry in changedSlots.items():
+        entry[field] = getNamesString(personIndex.getNames(key, field))
+
 
 class ExtendedName:
-    def __init__(self, name, entry, field, index, logger):
+    def __init__(self, name, entry, field, index, logger, personIndex=None, key=None):
         self.logger = logger
+        self.personIndex = personIndex
+        self.key = key
         self.entry = entry
         self.field = field
         self.index = index
@@ -549,20 +682,38 @@ class ExtendedName:
         return namestr.format(last=self.last, von=self.von, jr=self.jr)
 
     def fixFirstName(self, firsts):
+        """
+        :return: True if the name was changed (see updateEntry)
+        """
         if self.firsts != firsts:
             self.firsts = firsts
             self.first = ' '.join(firsts)
-            self.updateEntry()
+            return self.updateEntry()
+        return False
 
     def updateEntry(self):
-        names = self.entry.authors(self.field)
-        originalname = names[self.index]
+        """
+        Write the name to the entry.
+        With a personIndex, only the indexed name is replaced, and the caller writes the field once all of its names
+        are fixed (see nanny.PersonIndex.getNames).
+        :return: True if the name was changed
+        """
+        if self.personIndex is None:
+            names = self.entry.authors(self.field)
+            originalname = names[self.index]
+        else:
+            originalname = self.personIndex.getName(self.key, self.field, self.index)
         fixedname = self.getNameObject()
-        names[self.index] = fixedname
+        if fixedname == originalname:
+            return False
 
-        if fixedname != originalname:
+        if self.personIndex is None:
+            names[self.index] = fixedname
             self.entry[self.field] = getNamesString(names)
-            self.logger.addChange(self.entry.key, 'Fixed incomplete name', originalname.pretty(), fixedname.pretty())
+        else:
+            self.personIndex.updateName(self.key, self.field, self.index, fixedname)
+        self.logger.addChange(self.entry.key, 'Fixed incomplete name', originalname.pretty(), fixedname.pretty())
+        return True
 
     @classmethod
     def getExtendedNames(cls, entries, logger):
@@ -588,15 +739,17 @@ def getNamesString(names, template='{von} {last}, {jr}, {first}'):
         return ' and '.join([name.pretty(template) for name in names])
 
 
-def fixControlSequences(name, logger, fixLaTeX, fixUnicode):
+def fixControlSequences(name, logger, fixLaTeX, fixUnicode, converter=None):
     if fixLaTeX or fixUnicode:
+        if converter is None:
+            converter = TextConverter()
         name_dict = name._asdict()
         for name_key, name_elem in name_dict.items():
             if len(name_elem) > 0:
                 if fixLaTeX:
-                    name_elem = convertLaTeX2Unicode(name_elem)
+                    name_elem = converter.convert(TextConverter.LATEX2UNICODE, name_elem)
                 if fixUnicode:
-                    name_elem = convertUnicode2BibTeX(name_elem)
+                    name_elem = converter.convert(TextConverter.UNICODE2BIBTEX, name_elem)
                 name_dict[name_key] = name_elem
         fixed_name = name._replace(**name_dict)
         logger.logNameObjectDiff('Fixed control sequences', name, fixed_name)
@@ -694,72 +847,116 @@ def convertLaTeX2Unicode(string):
 
 
 def convertUnicode2BibTeX(string):
+    if string.isascii() and not RE_ASCII_BIBTEX_CHARS.search(string):
+        # Nothing to convert
+        return string
+    if not RE_MATH_OR_COMBINING.search(string):
+        return RE_BIBTEX_CHARS.sub(_getBibTeXChar, string)
+
+    # Convert the text between dollar signs and combining characters like above
     unicode_chars = []
     lastChar = None
-    isMathMode = False
-    for c, char in enumerate(string):
-        if isMathMode:
-            unicode_chars.append(char)
-            if char == '$' and lastChar != '\\':
-                isMathMode = False
-        else:
-            if char == '$' and lastChar != '\\':  # Start of mathmode
-                # print(c, string)
-                unicode_chars.append(char)
-                isMathMode = True
-            elif char == '$' and lastChar == '\\':  # Special handling for escaped dollar sign
-                del unicode_chars[-1]
-                unicode_chars.append(unicode2bibtex[char])
-            elif char in unicode2bibtex:  # Unicode character requires conversion
-                unicode_chars.append(unicode2bibtex[char])
-            elif char in unicodeCombiningCharacter2bibtex:  # Is combining character, read next char
-                pass
-                if len(unicode_chars) > 0 and unicode_chars[-1] == ' ':  # Delete unicode space
-                    del unicode_chars[-1]
-            elif lastChar in unicodeCombiningCharacter2bibtex:  # Merge char with previous combining char
-                combinedCharacter = unicodeCombiningCharacter2bibtex[lastChar].format(char)
-                unicode_chars.append(combinedCharacter)
-            else:  # Not a special char, read in normally
-                unicode_chars.append(char)
+    trailingSpaces = 0  # Number of spaces at the end of unicode_chars that combining characters delete
+    offset = 0
+    while True:
+        specialMatch = RE_MATH_OR_COMBINING.search(string, offset)
+        end = specialMatch.start() if specialMatch else len(string)
+        mergedLastChar = False
+        if end > offset:
+            text = string[offset:end]
+            if lastChar in unicodeCombiningCharacter2bibtex:
+                char = text[0]
+                if char in unicode2bibtex:
+                    unicode_chars.append(unicode2bibtex[char])
+                else:  # Merge char with previous combining char
+                    unicode_chars.append(unicodeCombiningCharacter2bibtex[lastChar].format(char))
+                text = text[1:]
+                mergedLastChar = not text
+            unicode_chars.append(RE_BIBTEX_CHARS.sub(_getBibTeXChar, text))
+            trailingSpaces = len(text) - len(text.rstrip(' '))
+            lastChar = string[end - 1]
+        if specialMatch is None:
+            break
+
+        char = specialMatch.group()
+        offset = end + 1
+        if char == '$' and lastChar == '\\':  # Special handling for escaped dollar sign
+            if mergedLastChar:
+                del unicode_chars[-2:]
+            else:
+                unicode_chars[-1] = unicode_chars[-1][:-1]
+            unicode_chars.append(unicode2bibtex[char])
+            trailingSpaces = 0
+        elif char == '$':  # Mathmode is copied as it is, up to the next unescaped dollar sign
+            mathEnd = string.find('$', offset)
+            while mathEnd != -1 and string[mathEnd - 1] == '\\':
+                mathEnd = string.find('$', mathEnd + 1)
+            if mathEnd == -1:
+                unicode_chars.append(string[end:])
+                return ''.join(unicode_chars)
+            unicode_chars.append(string[end:mathEnd + 1])
+            offset = mathEnd + 1
+            trailingSpaces = 0
+        elif trailingSpaces > 0:  # Combining character: delete unicode space
+            unicode_chars[-1] = unicode_chars[-1][:-1]
+            trailingSpaces -= 1
         lastChar = char
 
     # Clean up if final char was a combining character
-    if not isMathMode and lastChar in unicodeCombiningCharacter2bibtex:
+    if lastChar in unicodeCombiningCharacter2bibtex:
         combinedCharacter = unicodeCombiningCharacter2bibtex[lastChar].format('{}')
         unicode_chars.append(combinedCharacter)
 
     return ''.join(unicode_chars)
 
 
+def _getBibTeXChar(charMatch):
+    return unicode2bibtex[charMatch.group()]
+
+
 def main():
     parser = argparse.ArgumentParser(description='Check the consistency of BibTeX entries.')
-    parser.add_argument('input')
+    parser.add_argument('input', nargs='+', help='One or more BibTeX files, which are combined in order')
     parser.add_argument('output')
     parser.add_argument('-a', '--aux')
     parser.add_argument('-c', '--config')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes used to parse and write the BibTeX file')
+    parser.add_argument('--cache-dir', help='Directory in which to cache parsed BibTeX files between runs')
+    parser.add_argument('--rewrite-all', action='store_true',
+                        help='Reformat all entries, instead of copying the entries that were not fixed unchanged')
 
     args = parser.parse_args()
 
     # Load BibTex file
-    entries, preamble = nanny.loadBibTex(args.input, loadPreamble=True)
-
-    # Load auxiliary file
+    # Without a cache, uncited entries are skipped by the parser
+    keyWhitelist = None
     if args.aux:
         keyWhitelist = nanny.loadCitedKeys(args.aux)
-        all_entries = entries
+    entries, preamble, key2source, entryCount = nanny.loadBibTex(args.input, loadPreamble=True, processes=args.jobs,
+                                                                 cacheDir=args.cache_dir, keyWhitelist=keyWhitelist,
+                                                                 keepSources=True, countEntries=True)
+    if args.aux:
+        # Drop cross-referenced entries that are not cited themselves
         entries = nanny.filterEntries(entries, keyWhitelist)
-        print('Used aux file to select {} entries from a total of {}.'.format(len(entries), len(all_entries)))
+        print('Used aux file to select {} entries from a total of {}.'.format(len(entries), entryCount))
 
     # Load config file
     config = FixerConfig(args.config)
     silentconfig = FixerSilentModeConfig(args.config)
 
     # Processing
-    fixEntries(entries, config, silentconfig)
+    changedKeys = fixEntries(entries, config, silentconfig)
 
     # Save fixed BibTex file
+    # Entries that were not fixed are copied from the input as they are
+    if args.rewrite_all:
+        key2source = None
+    else:
+        for key in changedKeys:
+            key2source.pop(key, None)
     nanny.saveBibTex(args.output, entries, preamble,
-                     month_to_macro=True, wrap_width=None, bibdesk_compatible=True)
+                     month_to_macro=True, wrap_width=None, bibdesk_compatible=True, key2source=key2source,
+                     processes=args.jobs)
 
 
 if __name__ == '__main__':